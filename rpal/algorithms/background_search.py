@@ -0,0 +1,121 @@
+import multiprocessing as mp
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import rpal.utils.constants as rpal_const
+from rpal.algorithms.search import Search
+
+
+def _planner_worker(
+    search: Search, shm_name, outcome, request, ready, stop_event, exited, seed
+):
+    existing_shm = shared_memory.SharedMemory(name=shm_name)
+    plan = np.ndarray(
+        1, dtype=rpal_const.PLAN_DTYPE(search.grid.shape), buffer=existing_shm.buf
+    )
+
+    def next_plan():
+        palp_pt, surf_normal = search.next()
+        sample_pt, grid = search.grid_estimate
+        plan[0] = (palp_pt, surf_normal, np.array(sample_pt), grid)
+        ready.set()
+
+    try:
+        # searches draw from the global generator, seed it as the ctrl process would
+        if seed is not None:
+            np.random.seed(seed)
+        next_plan()
+        while not stop_event.is_set():
+            if not request.wait(timeout=0.1):
+                continue
+            request.clear()
+            # nan: next() was called again without an outcome in between
+            if not np.isnan(outcome.value):
+                search.update_outcome(outcome.value)
+            next_plan()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # a crashed worker stays a zombie of the parent, so signal it explicitly
+        exited.set()
+        existing_shm.close()
+
+
+class BackgroundSearch(Search):
+    """
+    Runs a Search in its own process. The next target is planned as soon as the
+    outcome of the current palpation arrives, so by the time the robot has
+    finished contour following and returned, next() only copies the result out
+    of shared memory. seed seeds numpy's global generator in the planner process,
+    which the searches sample from. next() raises if the planner exits or takes
+    longer than timeout seconds (None waits forever).
+    """
+
+    def __init__(
+        self, search: Search, timeout=rpal_const.PLANNER_TIMEOUT, seed=None
+    ):
+        self.grid_shape = search.grid.shape
+        self.timeout = timeout
+        plan = np.zeros(1, dtype=rpal_const.PLAN_DTYPE(self.grid_shape))
+        self._shm = shared_memory.SharedMemory(create=True, size=plan.nbytes)
+        self._plan = np.ndarray(plan.shape, dtype=plan.dtype, buffer=self._shm.buf)
+        self._outcome = mp.Value("d", np.nan)
+        self._request = mp.Event()
+        self._ready = mp.Event()
+        self._stop_event = mp.Event()
+        self._exited = mp.Event()
+        self._pending = True
+        self._estimate = None
+        self._process = mp.Process(
+            target=_planner_worker,
+            args=(
+                search,
+                self._shm.name,
+                self._outcome,
+                self._request,
+                self._ready,
+                self._stop_event,
+                self._exited,
+                seed,
+            ),
+            daemon=True,
+        )
+        self._process.start()
+
+    def _post(self, val):
+        self._outcome.value = val
+        self._pending = True
+        self._request.set()
+
+    def update_outcome(self, val: float):
+        self._post(val)
+
+    def next(self):
+        if not self._pending:
+            self._post(np.nan)
+        start = time.monotonic()
+        while not self._ready.wait(timeout=0.1):
+            # next() runs in the control process, which can't is_alive() a sibling
+            if self._exited.is_set():
+                raise RuntimeError("planner process exited")
+            if self.timeout is not None and time.monotonic() - start >= self.timeout:
+                raise TimeoutError(f"planner took longer than {self.timeout}s")
+        plan = self._plan[0].copy()
+        self._ready.clear()
+        self._pending = False
+        self._estimate = (tuple(plan["sample_pt"]), plan["grid"])
+        return (plan["palp_pt"], plan["surf_normal"])
+
+    @property
+    def grid_estimate(self):
+        return self._estimate
+
+    def close(self):
+        self._stop_event.set()
+        self._process.join(timeout=1.0)
+        if self._process.is_alive():
+            self._process.terminate()
+        self._shm.close()
+        self._shm.unlink()
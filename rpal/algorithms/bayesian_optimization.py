@@ -2,27 +2,48 @@ import numpy as np
 from scipy.ndimage import gaussian_filter
 from scipy.stats import norm
 
-from rpal.algorithms.gp import gp_posterior, SquaredExpKernel
+from rpal.algorithms.gp import GaussianProcess, KernelCache, SquaredExpKernel
 from rpal.algorithms.grid import Grid, GridMap2D
 from rpal.algorithms.gui import HeatmapAnimation
 from rpal.utils.constants import HISTORY_DTYPE
 
 
 class BayesianOptimization:
-    def __init__(self, grid: Grid, kernel: SquaredExpKernel):
+    def __init__(
+        self,
+        grid: Grid,
+        kernel: SquaredExpKernel,
+        cache_dtype=np.float64,
+        cache_max_bytes=2**28,
+    ):
         self.grid = grid
         self.grid_mean = np.zeros(grid.shape)
         self.kernel = kernel
+        self.gp = GaussianProcess(kernel)
+        self.kernel_cache = KernelCache(
+            kernel, grid, dtype=cache_dtype, max_bytes=cache_max_bytes
+        )
+
+    def update_gp(self):
+        """extends the GP with observations added to the grid since the last call"""
+        X_visited = self.grid.X_visited
+        for i in range(len(self.gp), len(X_visited)):
+            x = X_visited[i]
+            k_x = self.kernel_cache.cross(self.gp.X, x[np.newaxis])[:, 0]
+            self.gp.add(x, self.grid[tuple(x)], k_x=k_x)
 
     def get_optimal_state(self):
         X_visited = self.grid.X_visited
         y_visited = self.grid.grid[X_visited[:, 0], X_visited[:, 1]]
         new_states = self.grid.unvisited_states()
 
-        mean_s, var_s = gp_posterior(new_states, X_visited, y_visited, self.kernel)
+        self.update_gp()
+        K_s_x = self.kernel_cache.cross(new_states, self.gp.X)
+        mean_s, var_s = self.gp.posterior(new_states, K_s_x=K_s_x)
         EPS = 0.01
         sigma = np.sqrt(var_s)
-        z = (mean_s - y_visited.max() - EPS) / sigma
+        with np.errstate(divide="ignore", invalid="ignore"):
+            z = (mean_s - y_visited.max() - EPS) / sigma
         ei_term = (mean_s - y_visited.max()) * norm.cdf(z) + sigma * norm.pdf(z)
 
         assert np.all(np.sqrt(var_s) >= 0)
@@ -1,6 +1,8 @@
+from collections import OrderedDict
 from typing import Tuple
 
 import numpy as np
+from scipy.linalg import cho_solve, solve_triangular
 
 from rpal.algorithms.grid import GridMap2D
 
@@ -29,6 +31,176 @@ class SquaredExpKernel:
         return K
 
 
+class KernelCache:
+    """
+    Caches kernel columns k(grid states, x) of a fixed grid. A column is
+    computed once when its state is first observed and afterwards every
+    cross-covariance against candidate states is a gather. Columns are
+    evicted least-recently-used once max_bytes is reached.
+    """
+
+    def __init__(self, kernel: SquaredExpKernel, grid, dtype=np.float64, max_bytes=2**28):
+        self.kernel = kernel
+        self._states = grid.vectorized_states.reshape(-1, 2)
+        self._row_of = np.full(grid.shape, -1, dtype=np.int64)
+        self._row_of[self._states[:, 0], self._states[:, 1]] = np.arange(len(self._states))
+
+        col_bytes = len(self._states) * np.dtype(dtype).itemsize
+        self._max_cols = max(1, int(max_bytes // col_bytes)) if max_bytes is not None else None
+        capacity = 64 if self._max_cols is None else min(64, self._max_cols)
+        self._cols = np.empty((len(self._states), capacity), dtype=dtype)
+        self._slots = OrderedDict()  # state row -> column slot, in LRU order
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._slots)
+
+    def rows(self, X: np.ndarray):
+        """row of each grid state in X (M, 2) or (M, 1, 2)"""
+        X = np.asarray(X).reshape(-1, 2).astype(np.int64)
+        rows = self._row_of[X[:, 0], X[:, 1]]
+        assert np.all(rows >= 0), "state is not a grid cell"
+        return rows
+
+    def _slot(self, row):
+        slot = self._slots.get(row)
+        if slot is not None:
+            self._slots.move_to_end(row)
+            self.hits += 1
+            return slot
+        self.misses += 1
+        if len(self._slots) < self._cols.shape[1]:
+            slot = len(self._slots)
+        elif self._max_cols is None or self._cols.shape[1] < self._max_cols:
+            capacity = 2 * self._cols.shape[1]
+            if self._max_cols is not None:
+                capacity = min(capacity, self._max_cols)
+            cols = np.empty((self._cols.shape[0], capacity), dtype=self._cols.dtype)
+            cols[:, : self._cols.shape[1]] = self._cols
+            slot = self._cols.shape[1]
+            self._cols = cols
+        else:
+            _, slot = self._slots.popitem(last=False)
+        self._cols[:, slot] = self.kernel(self._states, self._states[row])
+        self._slots[row] = slot
+        return slot
+
+    def column(self, x):
+        """k(grid states, x) for a single grid state x"""
+        return self._cols[:, self._slot(self.rows(x)[0])]
+
+    def cross(self, X_s: np.ndarray, X: np.ndarray):
+        """k(X_s, X) of shape (M, N) where both are grid states"""
+        rows_s = self.rows(X_s)
+        rows = self.rows(X)
+        if self._max_cols is None or len(rows) <= self._max_cols:
+            slots = [self._slot(row) for row in rows]
+            return self._cols[rows_s[:, np.newaxis], slots]
+        # more columns than fit in memory, copy each out before it can be evicted
+        K = np.empty((len(rows_s), len(rows)), dtype=self._cols.dtype)
+        for j, row in enumerate(rows):
+            K[:, j] = self._cols[rows_s, self._slot(row)]
+        return K
+
+
+class GaussianProcess:
+    """
+    GP regressor that keeps a Cholesky factor of the observation covariance and
+    grows it by one row per observation, so a posterior costs O(n^2 + m*n)
+    instead of refactoring/inverting K every step.
+    """
+
+    def __init__(self, kernel: SquaredExpKernel, noise_var=0.01, capacity=64):
+        self.kernel = kernel
+        self.noise_var = noise_var
+        self._n = 0
+        self._X = np.zeros((capacity, 2))
+        self._y = np.zeros(capacity)
+        self._L = np.zeros((capacity, capacity))
+
+    def __len__(self):
+        return self._n
+
+    @property
+    def X(self):
+        return self._X[: self._n]
+
+    @property
+    def y(self):
+        return self._y[: self._n]
+
+    @property
+    def L(self):
+        return self._L[: self._n, : self._n]
+
+    def _grow(self):
+        capacity = 2 * self._X.shape[0]
+        X = np.zeros((capacity, 2))
+        y = np.zeros(capacity)
+        L = np.zeros((capacity, capacity))
+        X[: self._n] = self.X
+        y[: self._n] = self.y
+        L[: self._n, : self._n] = self.L
+        self._X, self._y, self._L = X, y, L
+
+    def fit(self, X: np.ndarray, y: np.ndarray):
+        """Factorizes all observations at once, replacing any existing ones"""
+        n = len(X)
+        while self._X.shape[0] < n:
+            self._grow()
+        self._n = n
+        self._X[:n] = X
+        self._y[:n] = y
+        self._L[:n, :n] = np.linalg.cholesky(self.kernel.cov(self.X, noise_var=self.noise_var))
+        return self
+
+    def add(self, x, y, k_x=None):
+        """
+        Rank-one extension of the Cholesky factor with a new observation
+        x: (2,) state
+        y: observed f(x)
+        k_x: (n,) optional precomputed k(x, self.X)
+        """
+        if self._n == self._X.shape[0]:
+            self._grow()
+        x = np.asarray(x, dtype=np.float64).reshape(2)
+        n = self._n
+        if k_x is None:
+            k_x = self.kernel(self.X, x)
+        k_xx = self.kernel(x, x) + self.noise_var
+        if n > 0:
+            l = solve_triangular(self.L, k_x, lower=True, check_finite=False)
+            self._L[n, :n] = l
+            self._L[n, n] = np.sqrt(max(k_xx - l @ l, 1e-12))
+        else:
+            self._L[0, 0] = np.sqrt(k_xx)
+        self._X[n] = x
+        self._y[n] = y
+        self._n += 1
+
+    def posterior(self, X_s: np.ndarray, K_s_x: np.ndarray = None):
+        """
+        Computes posterior of p(f(X_s) | f(self.X))
+        X_s: np.ndarray (M, 2) or (M, 1, 2)
+        K_s_x: np.ndarray (M, N) optional precomputed k(X_s, self.X)
+        returns mean (M, 1), variance (M, 1)
+        """
+        X_s = X_s.reshape(-1, 2)
+        k_ss = self.kernel(X_s, X_s)
+        if self._n == 0:
+            return np.zeros((len(X_s), 1)), k_ss[:, np.newaxis]
+        if K_s_x is None:
+            K_s_x = self.kernel(X_s[:, np.newaxis, :], self.X[np.newaxis, :, :])
+        # alpha = K^-1 y, V = L^-1 K_x_s
+        alpha = cho_solve((self.L, True), self.y, check_finite=False)
+        V = solve_triangular(self.L, K_s_x.T, lower=True, check_finite=False)
+
+        posterior_mean = K_s_x @ alpha
+        posterior_var = np.maximum(k_ss - np.einsum("ij,ij->j", V, V), 0.0)
+        return posterior_mean[:, np.newaxis], posterior_var[:, np.newaxis]
+
+
 def gp_posterior(X_s: np.ndarray, X, y, kernel, noise_var=0.01):
     """
     Computes posterior of p(f(X_s) | f(self.X))
@@ -38,33 +210,8 @@ def gp_posterior(X_s: np.ndarray, X, y, kernel, noise_var=0.01):
     kernel: SquaredExpKernel
     noise_var: float
     """
-    y = y[:, np.newaxis]
-
-    # print("X", X.shape)
-    # print("X_s", X_s.shape)
-    # print("y", y.shape)
-
-    K = kernel.cov(X)
-    # print("K", K)
-
-    # print("X_s", X_s.shape)
-    K_s_x = kernel(X_s, X)
-    K_s_x = K_s_x[..., np.newaxis]
-    # print("K_s_x", K_s_x.shape)
-
-    beta = np.einsum("ijk,jj->ijk", K_s_x, np.linalg.inv(K))
-    # print("beta", beta.shape)
-
-    k_ss = kernel(X_s, X_s)
-    # print("k_ss", k_ss.shape)
-
-    # these are dot products
-    posterior_mean = np.einsum("ijk,jk->ik", beta, y)
-    posterior_std = k_ss + np.einsum("ijk,ijk->ik", beta, K_s_x)
-
-    # print("posterior_mean", posterior_mean.shape)
-    # print("posterior_std", posterior_std.shape)
-    return posterior_mean, posterior_std
+    gp = GaussianProcess(kernel, noise_var=noise_var, capacity=max(len(X), 1))
+    return gp.fit(X, y).posterior(X_s)
 
 
 if __name__ == "__main__":
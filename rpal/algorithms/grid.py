@@ -1,18 +1,33 @@
 from functools import cached_property
+from pathlib import Path
 from typing import Tuple, Type, TypeVar, List
 
 import numpy as np
 import open3d as o3d
+from scipy.spatial import cKDTree
 
+import rpal.utils.constants as rpal_const
+from rpal.utils.cache_utils import cache_file, hash_arrays, save_npz
 from rpal.utils.math_utils import project_axis_to_plane, unit
-from rpal.utils.pcd_utils import visualize_pcds
+from rpal.utils.pcd_utils import mesh2roi, scan2mesh, visualize_pcds
+
+# bump when the SurfaceGridMap build or file layout changes to invalidate caches
+SURFACE_GRID_VERSION = 2
 
 
 class Grid:
 
     def __init__(self):
         self.grid = None
-        self._X_visited = []
+        self._X_visited = np.zeros((16, 2), dtype=np.int64)
+        self._n_visited = 0
+        # flat (raveled) bookkeeping, built lazily once the grid shape is known
+        self._states_flat = None  # vectorized_states as flat indices
+        self._visited = None
+        self._unvisited = None  # unvisited flat indices, order scrambled by swap-remove
+        self._unvisited_pos = None  # position of each flat index in self._unvisited
+        self._n_unvisited = 0
+        self._unvisited_states = None
 
     @cached_property
     def vectorized_states(self):
@@ -24,17 +39,34 @@ class Grid:
         states = states[:, np.newaxis, :]
         return states
 
+    def _init_visited(self):
+        if self._visited is not None:
+            return
+        size = int(np.prod(self.shape))
+        flat = np.ravel_multi_index(self.vectorized_states.reshape(-1, 2).T, self.shape)
+        self._states_flat = flat
+        self._visited = np.zeros(size, dtype=bool)
+        self._unvisited = flat.copy()
+        self._unvisited_pos = np.full(size, -1, dtype=np.int64)
+        self._unvisited_pos[flat] = np.arange(len(flat))
+        self._n_unvisited = len(flat)
+
     def unvisited_states(self):
-        if len(self.X_visited) == 0:
+        if self._n_visited == 0:
             return self.vectorized_states
-        all_states = self.vectorized_states
-        all_states = np.ravel_multi_index(all_states.T, self.shape)
-        visited_states = np.ravel_multi_index(self.X_visited.T, self.shape)
-        new_states_flat = np.setdiff1d(all_states, visited_states, assume_unique=True)
-        new_states = np.unravel_index(new_states_flat, self.shape)
-        new_states = np.array(new_states).T
-        new_states = new_states[:, np.newaxis, :]
-        return new_states
+        if self._unvisited_states is None:
+            new_states = self.vectorized_states[~self._visited[self._states_flat]]
+            new_states.flags.writeable = False
+            self._unvisited_states = new_states
+        return self._unvisited_states
+
+    def reset(self):
+        """clears all observations so the same grid can be searched again"""
+        self.grid = np.zeros_like(self.grid)
+        self._X_visited = np.zeros((16, 2), dtype=np.int64)
+        self._n_visited = 0
+        self._visited = None
+        self._unvisited_states = None
 
     def __getitem__(self, index):
         r, c = index
@@ -42,21 +74,43 @@ class Grid:
 
     def update(self, index, value):
         r, c = index
-        self._X_visited.append(index)
+        self._init_visited()
+        if self._n_visited == len(self._X_visited):
+            self._X_visited = np.concatenate([self._X_visited, np.zeros_like(self._X_visited)])
+        self._X_visited[self._n_visited] = index
+        self._n_visited += 1
         self.grid[r, c] = value
 
+        flat = np.ravel_multi_index((r, c), self.shape)
+        if self._visited[flat]:
+            return
+        self._visited[flat] = True
+        self._unvisited_states = None
+        pos = self._unvisited_pos[flat]
+        if pos >= 0:
+            # swap-remove from the unvisited index array
+            last = self._unvisited[self._n_unvisited - 1]
+            self._unvisited[pos] = last
+            self._unvisited_pos[last] = pos
+            self._unvisited_pos[flat] = -1
+            self._n_unvisited -= 1
+
     def sample_uniform(self, from_unvisited=False):
         if from_unvisited:
-            vectorized_states = self.unvisited_states()
-        else:
-            vectorized_states = self.vectorized_states
+            self._init_visited()
+            flat = self._unvisited[np.random.randint(0, self._n_unvisited)]
+            return tuple(np.unravel_index(flat, self.shape))
+        vectorized_states = self.vectorized_states
         state = vectorized_states[np.random.randint(0, vectorized_states.shape[0])]
         return tuple(state.flatten())
 
     @property
     def X_visited(self):
-        visited = np.array(self._X_visited)
-        return np.array(visited)
+        if self._n_visited == 0:
+            return np.array([])
+        visited = self._X_visited[: self._n_visited]
+        visited.flags.writeable = False
+        return visited
 
     @property
     def shape(self):
@@ -87,7 +141,9 @@ class GridMap2D(Grid):
 
 class SurfaceGridMap(Grid):
 
-    def __init__(self, pcd, grid_size=0.001, nn=10, max_r=100, max_c=100):
+    def __init__(
+        self, pcd, grid_size=0.001, nn=10, max_r=100, max_c=100, builder="frontier"
+    ):
         super().__init__()
         self._grid_size = grid_size
         self._nn = nn
@@ -157,16 +213,98 @@ class SurfaceGridMap(Grid):
         ])
         self._T[:3, 3] = grid_origin
 
+        # visualize_pcds([self._pcd, self._bbox, rot_bbox], tfs=[self._T])
+
         # cells are defined by their center point, normal vector, and xyz axes
-        self._pcd_tree = o3d.geometry.KDTreeFlann(self._pcd)
-        self._cells = []
-        self.grid_idx2cell_idx = {}
-        self.cell_idx2grid_idx = {}
+        if builder == "frontier":
+            cells = self._build_grid_frontier(grid_origin, xaxis_origin, verts, norms)
+        elif builder == "recursive":
+            cells = self._build_grid_recursive(grid_origin, xaxis_origin, norms)
+        else:
+            raise RuntimeError("Invalid builder!")
+        self._set_cells(*cells)
 
-        # visualize_pcds([self._pcd, self._bbox, rot_bbox], tfs=[self._T])
+        self._grid_pcd = o3d.geometry.PointCloud()
+        self._grid_pcd.points = o3d.utility.Vector3dVector(self._centers)
+        self._grid_pcd.estimate_normals()
+
+    def _set_cells(self, grid_idxs, xaxes, yaxes, normals, centers):
+        """stores cells as contiguous (N, 3) arrays with dense grid <-> cell lookup tables"""
+        self._xaxes = np.ascontiguousarray(xaxes, dtype=np.float64)
+        self._yaxes = np.ascontiguousarray(yaxes, dtype=np.float64)
+        self._normals = np.ascontiguousarray(normals, dtype=np.float64)
+        self._centers = np.ascontiguousarray(centers, dtype=np.float64)
+
+        self.cell_idx2grid_idx = np.ascontiguousarray(grid_idxs, dtype=np.int32)
+        self._grid_shape = list(np.max(self.cell_idx2grid_idx, axis=0).astype(np.int64) + 1)
+        self.grid_idx2cell_idx = np.full(self._grid_shape, -1, dtype=np.int32)
+        self.grid_idx2cell_idx[self.cell_idx2grid_idx[:, 0],
+                               self.cell_idx2grid_idx[:, 1]] = np.arange(len(self._centers))
+        self.grid = np.zeros(self._grid_shape)
+        self._grid_tree = cKDTree(self._centers)
+
+    def _build_grid_frontier(self, grid_origin, xaxis_origin, verts, norms):
+        """
+        grows the grid breadth-first: every cell of wavefront i + j = d is
+        tested against the bbox and the surface in one batched query each.
+        Cells are ordered by wavefront, then by the order they were proposed.
+        """
+        pcd_tree = cKDTree(verts)
+        cells = []
+
+        frontier_idxs = np.zeros((1, 2), dtype=np.int64)
+        frontier_centers = grid_origin[np.newaxis].copy()
+        while len(frontier_idxs) > 0:
+            keep = (frontier_idxs[:, 0] < self._max_r) & (frontier_idxs[:, 1] < self._max_c)
+            inds = self._bbox.get_point_indices_within_bounding_box(
+                o3d.utility.Vector3dVector(frontier_centers))
+            in_bbox = np.zeros(len(frontier_idxs), dtype=bool)
+            in_bbox[np.asarray(inds, dtype=np.int64)] = True
+            keep &= in_bbox
+
+            # KDTreeFlann returned squared distances, keep the same acceptance threshold
+            dists, nn_inds = pcd_tree.query(frontier_centers, k=1)
+            keep &= dists**2 <= self._grid_size
+
+            # the same cell can be proposed by its x and y neighbour, first valid one wins
+            candidates = np.flatnonzero(keep)
+            flat = frontier_idxs[candidates, 0] * (self._max_c + 1) + frontier_idxs[candidates, 1]
+            _, first = np.unique(flat, return_index=True)
+            accepted = candidates[np.sort(first)]
+            if len(accepted) == 0:
+                break
+
+            cell_idxs = frontier_idxs[accepted]
+            cell_centers = frontier_centers[accepted]
+            grid_normals = norms[nn_inds[accepted]]
+
+            # project_axis_to_plane for every cell at once
+            plane_normals = grid_normals / np.linalg.norm(grid_normals, axis=1, keepdims=True)
+            xaxis = unit(xaxis_origin.copy())
+            xaxis_cells = xaxis - (plane_normals @ xaxis)[:, np.newaxis] * plane_normals
+            xaxis_cells /= np.linalg.norm(xaxis_cells, axis=1, keepdims=True)
+            yaxis_cells = np.cross(grid_normals, xaxis_cells)
+
+            cells.append((cell_idxs, xaxis_cells, yaxis_cells, grid_normals, cell_centers))
+
+            # propose the +x and +y neighbour of every new cell
+            frontier_idxs = np.empty((2 * len(accepted), 2), dtype=np.int64)
+            frontier_idxs[0::2] = cell_idxs + [1, 0]
+            frontier_idxs[1::2] = cell_idxs + [0, 1]
+            frontier_centers = np.empty((2 * len(accepted), 3))
+            frontier_centers[0::2] = cell_centers + xaxis_cells * self._grid_size
+            frontier_centers[1::2] = cell_centers + yaxis_cells * self._grid_size
+
+        return tuple(np.concatenate(arrs) for arrs in zip(*cells))
+
+    def _build_grid_recursive(self, grid_origin, xaxis_origin, norms):
+        """grows the grid depth-first, one knn query per cell"""
+        self._pcd_tree = o3d.geometry.KDTreeFlann(self._pcd)
+        cells = []
+        grid_idx2cell_idx = {}
 
         def build_grid(cell_center, grid_idx=(0, 0)):
-            if grid_idx in self.grid_idx2cell_idx:
+            if grid_idx in grid_idx2cell_idx:
                 return 0
 
             if grid_idx[0] >= self._max_r or grid_idx[1] >= self._max_c:
@@ -193,11 +331,8 @@ class SurfaceGridMap(Grid):
                 new_cell_idx_center_dx = cell_center + xaxis_cell * self._grid_size
                 new_cell_idx_center_dy = cell_center + yaxis_cell * self._grid_size
 
-                self._cells.append((xaxis_cell, yaxis_cell, grid_normal, cell_center))
-
-                cell_idx = len(self._cells) - 1
-                self.grid_idx2cell_idx[grid_idx] = cell_idx
-                self.cell_idx2grid_idx[cell_idx] = grid_idx
+                cells.append((grid_idx, xaxis_cell, yaxis_cell, grid_normal, cell_center))
+                grid_idx2cell_idx[grid_idx] = len(cells) - 1
 
                 new_cell_idx_in_x = (grid_idx[0] + 1, grid_idx[1] + 0)
                 new_cell_idx_in_y = (grid_idx[0] + 0, grid_idx[1] + 1)
@@ -208,38 +343,91 @@ class SurfaceGridMap(Grid):
                 return 0
 
         build_grid(grid_origin)
-
-        idxs = np.asarray(list(self.grid_idx2cell_idx.keys()))
-        self._grid_shape = list(np.max(idxs, axis=0) + 1)
-        self.grid = np.zeros(self._grid_shape)
-
-        self._grid_arr = np.zeros((len(self.grid_idx2cell_idx), 3))
-        # populate grid pcd
-        for idx in self.grid_idx2cell_idx.values():
-            self._grid_arr[idx] = self._cells[idx][-1]  # add root point
-        self._grid_pcd = o3d.geometry.PointCloud()
-        self._grid_pcd.points = o3d.utility.Vector3dVector(self._grid_arr)
-        self._grid_pcd.estimate_normals()
-        self._grid_pcd_tree = o3d.geometry.KDTreeFlann(self._grid_pcd)
+        return tuple(np.array(arrs) for arrs in zip(*cells))
+
+    def save(self, path: Path):
+        """serializes the grid, its ROI point cloud and lookup tables to one .npz"""
+        save_npz(
+            path,
+            version=SURFACE_GRID_VERSION,
+            grid_size=self._grid_size,
+            nn=self._nn,
+            max_r=self._max_r,
+            max_c=self._max_c,
+            grid_shape=np.asarray(self._grid_shape),
+            T=self._T,
+            bbox_pts=np.asarray(self._bbox.get_box_points()),
+            xaxes=self._xaxes,
+            yaxes=self._yaxes,
+            normals=self._normals,
+            centers=self._centers,
+            grid_idxs=self.cell_idx2grid_idx,
+            grid_normals=np.asarray(self._grid_pcd.normals),
+            pcd_points=np.asarray(self._pcd.points),
+            pcd_normals=np.asarray(self._pcd.normals),
+            pcd_colors=np.asarray(self._pcd.colors),
+        )
+
+    @classmethod
+    def load(cls, path: Path):
+        data = np.load(str(path))
+        assert int(data["version"]) == SURFACE_GRID_VERSION, f"stale grid file {path}"
+        grid_map = cls.__new__(cls)
+        Grid.__init__(grid_map)
+        grid_map._grid_size = float(data["grid_size"])
+        grid_map._nn = int(data["nn"])
+        grid_map._max_r = int(data["max_r"])
+        grid_map._max_c = int(data["max_c"])
+        grid_map._T = data["T"]
+
+        grid_map._pcd = o3d.geometry.PointCloud()
+        grid_map._pcd.points = o3d.utility.Vector3dVector(data["pcd_points"])
+        grid_map._pcd.normals = o3d.utility.Vector3dVector(data["pcd_normals"])
+        if len(data["pcd_colors"]) > 0:
+            grid_map._pcd.colors = o3d.utility.Vector3dVector(data["pcd_colors"])
+        grid_map._bbox = o3d.geometry.OrientedBoundingBox.create_from_points(
+            o3d.utility.Vector3dVector(data["bbox_pts"]))
+        grid_map._bbox.color = [1, 0, 0]
+
+        grid_map._set_cells(data["grid_idxs"], data["xaxes"], data["yaxes"], data["normals"],
+                            data["centers"])
+        assert grid_map._grid_shape == list(data["grid_shape"])
+
+        grid_map._grid_pcd = o3d.geometry.PointCloud()
+        grid_map._grid_pcd.points = o3d.utility.Vector3dVector(grid_map._centers)
+        grid_map._grid_pcd.normals = o3d.utility.Vector3dVector(data["grid_normals"])
+        return grid_map
 
     def pt_to_idx(self, pt):
-        num_neighbors, inds, dists = self._grid_pcd_tree.search_knn_vector_3d(pt, 1)
-        assert len(inds) == 1
-        return self.cell_idx2grid_idx[inds[0]]
+        _, cell_idx = self._grid_tree.query(pt, k=1)
+        return tuple(self.cell_idx2grid_idx[cell_idx].tolist())
+
+    def pt_to_idx_many(self, pts: np.ndarray):
+        """grid indices (M, 2) of the cells nearest to pts (M, 3)"""
+        _, cell_idxs = self._grid_tree.query(pts, k=1)
+        return self.cell_idx2grid_idx[cell_idxs]
 
     def idx_to_pt(self, idx):
         assert isinstance(idx, tuple)
         cell_idx = self.grid_idx2cell_idx[idx]
-
-        xaxis, yaxis, zaxis, cell_center = self._cells[cell_idx]
-        return (cell_center, zaxis)
+        if cell_idx < 0:
+            raise KeyError(idx)
+        return (self._centers[cell_idx], self._normals[cell_idx])
+
+    def idx_to_pt_many(self, idxs: np.ndarray):
+        """cell centers (M, 3) and normals (M, 3) of grid indices (M, 2)"""
+        idxs = np.asarray(idxs).reshape(-1, 2)
+        cell_idxs = self.grid_idx2cell_idx[idxs[:, 0], idxs[:, 1]]
+        if np.any(cell_idxs < 0):
+            raise KeyError(idxs[cell_idxs < 0])
+        return self._centers[cell_idxs], self._normals[cell_idxs]
 
     def visualize(self, show_tf=False):
         tfs = []
         if show_tf:
             cluster_colors = np.random.rand(len(self._grid_pcd.points), 3)
-            for grid, idx in self.grid_idx2cell_idx.items():
-                xaxis, yaxis, zaxis, cell_center = self._cells[idx]
+            for xaxis, yaxis, zaxis, cell_center in zip(self._xaxes, self._yaxes, self._normals,
+                                                        self._centers):
                 # Create array of all possible combinations of 0 and 1 for x, y, and z
                 corners = np.array(np.meshgrid([0, 1], [0, 1], [0, 1])).T.reshape(-1, 3)
                 corners = corners.astype(np.float32)
@@ -266,7 +454,7 @@ class SurfaceGridMap(Grid):
         Xx, Xy = np.meshgrid(gx, gy)
 
         states = np.array([Xx.reshape(-1), Xy.reshape(-1)]).transpose()
-        states = np.array(list(self.grid_idx2cell_idx.keys()))
+        states = self.cell_idx2grid_idx.astype(np.int64)
         assert np.all(states[:, 0] < nx) and np.all(states[:, 1] < ny)
         states = states[:, np.newaxis, :]
         return states
@@ -279,6 +467,11 @@ class SurfaceGridMap(Grid):
     def grid_pcd(self):
         return self._grid_pcd
 
+    @property
+    def pcd(self):
+        """ROI point cloud the grid was grown on"""
+        return self._pcd
+
     @property
     def grid_size(self):
         return self._grid_size
@@ -286,3 +479,39 @@ class SurfaceGridMap(Grid):
     @property
     def grid_pcd(self):
         return self._grid_pcd
+
+
+def cached_surface_grid_map(
+    scan_pcd, bbox_pts, grid_size=0.001, nn=10, max_r=100, max_c=100,
+    cache_dir=rpal_const.GRID_CACHE_PATH
+):
+    """
+    Runs scan2mesh -> mesh2roi -> SurfaceGridMap on a raw surface scan, or loads the
+    result from cache_dir if the same scan, ROI bbox and grid parameters were used before.
+    bbox_pts=None (interactive ROI selection) always rebuilds.
+    """
+    if bbox_pts is None:
+        roi_pcd = mesh2roi(scan2mesh(scan_pcd), bbox_pts=None)
+        return SurfaceGridMap(roi_pcd, grid_size=grid_size, nn=nn, max_r=max_r, max_c=max_c)
+
+    key = hash_arrays(
+        np.asarray(scan_pcd.points),
+        np.asarray(scan_pcd.colors),
+        np.asarray(bbox_pts),
+        rpal_const.BBOX_PHANTOM,
+        rpal_const.GT_SCAN_POSE,
+        grid_size=float(grid_size),
+        nn=int(nn),
+        max_r=int(max_r),
+        max_c=int(max_c),
+        version=SURFACE_GRID_VERSION,
+    )
+    path = cache_file(cache_dir, "surface_grid", key)
+    if path.exists():
+        print(f"loading cached grid {path.name}")
+        return SurfaceGridMap.load(path)
+
+    roi_pcd = mesh2roi(scan2mesh(scan_pcd), bbox_pts=bbox_pts)
+    surface_grid_map = SurfaceGridMap(roi_pcd, grid_size=grid_size, nn=nn, max_r=max_r, max_c=max_c)
+    surface_grid_map.save(path)
+    return surface_grid_map
@@ -5,29 +5,207 @@ import open3d as o3d
 from rpal.algorithms.active_area_search import ActiveAreaSearch
 from rpal.algorithms.bayesian_optimization import BayesianOptimization
 from rpal.algorithms.gp import SquaredExpKernel
-from rpal.algorithms.grid import SurfaceGridMap
+from rpal.algorithms.grid import SurfaceGridMap, cached_surface_grid_map
 from rpal.algorithms.gui import HeatmapAnimation
 import rpal.utils.constants as rpal_const
+from rpal.utils.data_utils import NpyAppender, NpyWriterThread, load_npy
+
+
+SEARCH_HISTORY_FILE = "search_history.npy"
+SEARCH_HISTORY_INDEX_FILE = "search_history_index.npy"
+SEARCH_HISTORY_KEYFRAMES_FILE = "search_history_keyframes.npy"
+SEARCH_HISTORY_DELTAS_FILE = "search_history_deltas.npy"
+
+
+class DeltaHistory:
+    """Random access to frames of a delta encoded search history.
+
+    Frame i is keyframes[index[i].keyframe] with the cell updates in
+    deltas[index[i].delta_start:index[i].delta_end] applied in order.
+    """
+
+    def __init__(self, index, keyframes, deltas):
+        self.index = index
+        self.keyframes = keyframes
+        self.deltas = deltas
+        self.dtype = rpal_const.HISTORY_DTYPE(keyframes.shape[1:])
+
+    def __len__(self):
+        return len(self.index)
+
+    def grid(self, i):
+        entry = self.index[i]
+        grid = np.array(self.keyframes[entry["keyframe"]])
+        deltas = self.deltas[entry["delta_start"] : entry["delta_end"]]
+        if len(deltas) > 0:
+            # keep the last update of each cell
+            cells, last = np.unique(deltas["cell"][::-1], return_index=True)
+            grid.reshape(-1)[cells] = deltas["value"][::-1][last]
+        return grid
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return np.array([self[j] for j in range(*i.indices(len(self)))])
+        frame = np.empty((), dtype=self.dtype)
+        frame["sample_pt"] = self.index[i]["sample_pt"]
+        frame["grid"] = self.grid(i)
+        return frame[()]
+
+    @classmethod
+    def load(cls, folder: Path):
+        return cls(
+            load_npy(folder / SEARCH_HISTORY_INDEX_FILE),
+            load_npy(folder / SEARCH_HISTORY_KEYFRAMES_FILE),
+            load_npy(folder / SEARCH_HISTORY_DELTAS_FILE),
+        )
+
+
+def load_search_history(folder: Path):
+    """search history of a dataset folder, memory-mapped rather than loaded"""
+    if (folder / SEARCH_HISTORY_FILE).exists():
+        return load_npy(folder / SEARCH_HISTORY_FILE)
+    return DeltaHistory.load(folder)
 
 
 class SearchHistory:
-    def __init__(self):
-        self._history = []
+    """Grid estimate at every palpation.
+
+    Without a folder, frames are kept in a preallocated array and written by
+    save(). With a folder they are appended to memory-mapped files as they
+    come in, either densely to search_history.npy or, with delta=True, as the
+    cells that changed since the previous frame plus a full keyframe every
+    keyframe_interval frames (or when most of the grid changed). The appends,
+    with their flush and fsync, run on an NpyWriterThread so add() never waits
+    on the disk.
+    """
+
+    def __init__(self, folder: Path = None, delta=False, keyframe_interval=20):
+        self.folder = folder
+        self.delta = delta
+        self.keyframe_interval = keyframe_interval
+        self.n = 0
+        self._frames = None
+        self._index = None
+        self._writer = None
+        self._saved = False
+
+    def __len__(self):
+        return self.n
+
+    def _init_storage(self, grid_shape):
+        dtype = rpal_const.HISTORY_DTYPE(grid_shape)
+        if self.folder is None:
+            self._frames = np.zeros(16, dtype=dtype)
+        elif not self.delta:
+            self._frames = NpyAppender(self.folder / SEARCH_HISTORY_FILE, dtype)
+            self._writer = NpyWriterThread(self._frames)
+        else:
+            self._index = NpyAppender(
+                self.folder / SEARCH_HISTORY_INDEX_FILE,
+                rpal_const.HISTORY_INDEX_DTYPE,
+            )
+            self._keyframes = NpyAppender(
+                self.folder / SEARCH_HISTORY_KEYFRAMES_FILE,
+                np.float32,
+                row_shape=grid_shape,
+                capacity=16,
+            )
+            self._deltas = NpyAppender(
+                self.folder / SEARCH_HISTORY_DELTAS_FILE,
+                rpal_const.HISTORY_DELTA_DTYPE,
+            )
+            self._writer = NpyWriterThread(self._index, self._keyframes, self._deltas)
+            self._prev_grid = None
+            self._keyframe_start = 0
+            # rows queued so far, the appenders lag behind until the writer catches up
+            self._n_keyframes = 0
+            self._n_deltas = 0
+
+    def _add_delta(self, next_state, grid):
+        grid = grid.astype(np.float32).reshape(-1)
+        n_deltas = self._n_deltas
+        changed = None
+        if self._prev_grid is not None and self.n % self.keyframe_interval != 0:
+            changed = np.flatnonzero(grid != self._prev_grid)
+            if len(changed) > grid.size // 2:
+                changed = None
+        if changed is None:
+            self._writer.put(grid.reshape(self._keyframes.row_shape), 1)
+            self._n_keyframes += 1
+            self._keyframe_start = n_deltas
+        elif len(changed) > 0:
+            deltas = np.empty(len(changed), dtype=rpal_const.HISTORY_DELTA_DTYPE)
+            deltas["cell"] = changed
+            deltas["value"] = grid[changed]
+            self._writer.put(deltas, 2)
+            self._n_deltas += len(changed)
+        entry = np.empty(1, dtype=rpal_const.HISTORY_INDEX_DTYPE)
+        entry["sample_pt"] = next_state
+        entry["keyframe"] = self._n_keyframes - 1
+        entry["delta_start"] = self._keyframe_start
+        entry["delta_end"] = self._n_deltas
+        self._writer.put(entry, 0)
+        self._prev_grid = grid
 
     def add(self, next_state: tuple, grid: np.ndarray):
-        self._history.append(
-            np.array(
-                (np.array(next_state), grid),
-                dtype=rpal_const.HISTORY_DTYPE(grid.shape),
+        if self._frames is None and self._index is None:
+            self._init_storage(grid.shape)
+        if self.delta and self.folder is not None:
+            self._add_delta(next_state, grid)
+        elif self.folder is not None:
+            frame = np.empty(1, dtype=self._frames.dtype)
+            frame["sample_pt"] = next_state
+            frame["grid"] = grid
+            self._writer.put(frame)
+        else:
+            if self.n == len(self._frames):
+                self._frames = np.resize(self._frames, 2 * self.n)
+            self._frames[self.n] = (np.array(next_state), grid)
+        self.n += 1
+
+    def __getitem__(self, i):
+        return self.frames[i]
+
+    @property
+    def frames(self):
+        """random access view of the frames, nothing is copied"""
+        if self._saved and self.folder is not None:
+            return load_search_history(self.folder)
+        if self._writer is not None:
+            self._writer.flush()
+        if self._index is not None:
+            return DeltaHistory(
+                self._index.data, self._keyframes.data, self._deltas.data
             )
-        )
+        if self._frames is None:
+            return np.array([])
+        if self.folder is not None:
+            return self._frames.data
+        return self._frames[: self.n]
 
-    def save(self, folder: Path):
-        np.save(str(folder / "search_history.npy"), self.history)
+    def save(self, folder: Path = None):
+        """
+        writes the frames to folder, or finishes the streamed files when the history
+        was created with a folder, in which case folder can only repeat it
+        """
+        if self.folder is None:
+            assert folder is not None, "in-memory history needs a folder to save to"
+            np.save(str(folder / SEARCH_HISTORY_FILE), self.history)
+        else:
+            if folder is not None:
+                assert Path(folder).resolve() == Path(self.folder).resolve(), (
+                    f"history streams to {self.folder}, can't save to {folder}"
+                )
+            if self._writer is not None:
+                self._writer.close()
+        self._saved = True
 
     @property
     def history(self):
-        return np.array(self._history)
+        frames = self.frames
+        if isinstance(frames, DeltaHistory):
+            return frames[:]
+        return np.array(frames)
 
 
 class Search:
@@ -88,7 +266,7 @@ class ActiveSearch(Search):
                 self.grid, self.group_quadtree, self.kernel, **kwargs
             )
         elif algo is ActiveSearchAlgos.BO:
-            self.algo = BayesianOptimization(self.grid, self.kernel)
+            self.algo = BayesianOptimization(self.grid, self.kernel, **kwargs)
         else:
             raise RuntimeError("Invalid algo!")
 
@@ -102,6 +280,8 @@ class ActiveSearch(Search):
 
     def update_outcome(self, val: float):
         self.grid.update(self.next_state, val)
+        if isinstance(self.algo, BayesianOptimization):
+            self.algo.update_gp()
 
     @property
     def grid_estimate(self):
@@ -156,17 +336,24 @@ class ActiveSearchWithRandomInit(Search):
 
 
 if __name__ == "__main__":
-    from rpal.utils.pcd_utils import scan2mesh, mesh2roi, visualize_pcds
+    import argparse
+
+    from rpal.utils.pcd_utils import scan2mesh, visualize_pcds
     from rpal.utils.transform_utils import quat2mat
     from scipy.spatial.transform import Rotation
 
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument(
+        "--no_vis", action="store_true", help="skip the plots and the surface mesh"
+    )
+    args = argparser.parse_args()
+
     np.random.seed(100)
     pcd = o3d.io.read_point_cloud(str(rpal_const.SURFACE_SCAN_PATH))
-    surface_mesh = scan2mesh(pcd)
-    roi_pcd = mesh2roi(surface_mesh, bbox_pts=rpal_const.BBOX_ROI)
 
     search_history = SearchHistory()
-    surface_grid_map = SurfaceGridMap(roi_pcd, grid_size=0.001)
+    surface_grid_map = cached_surface_grid_map(pcd, rpal_const.BBOX_ROI, grid_size=0.001)
+    roi_pcd = surface_grid_map.pcd
     # planner = RandomSearch(roi_pcd, surface_grid_map)
     # planner.grid.visualize(show_tf=True)
     # planner = ActiveSearch(ActiveSearchAlgos.BO, roi_pcd, kernel_scale=2.0)
@@ -192,15 +379,18 @@ if __name__ == "__main__":
         palp_Ts.append(T.copy())
         surf_norms.append(palp)
 
-    ani = HeatmapAnimation(np.array(search_history.history))
-    ani.visualize()
+    if not args.no_vis:
+        ani = HeatmapAnimation(np.array(search_history.history))
+        ani.visualize()
 
-    roi_pcd.paint_uniform_color([1, 0, 0])
+        roi_pcd.paint_uniform_color([1, 0, 0])
 
-    gt_scan = o3d.io.read_point_cloud(str(rpal_const.GT_PATH))
-    visualize_pcds(
-        [planner.grid._grid_pcd, gt_scan],
-        meshes=[surface_mesh],
-        tfs=palp_Ts,
-        surf_norms=surf_norms,
-    )
+        # the cached grid doesn't need the Poisson mesh, build it only for display
+        surface_mesh = scan2mesh(pcd)
+        gt_scan = o3d.io.read_point_cloud(str(rpal_const.GT_PATH))
+        visualize_pcds(
+            [planner.grid._grid_pcd, gt_scan],
+            meshes=[surface_mesh],
+            tfs=palp_Ts,
+            surf_norms=surf_norms,
+        )
@@ -0,0 +1,57 @@
+import argparse
+import copy
+import sys
+
+import numpy as np
+import open3d as o3d
+
+import rpal.utils.constants as rpal_const
+from rpal.algorithms.grid import SurfaceGridMap
+from rpal.utils.pcd_utils import mesh2roi, scan2mesh
+from rpal.utils.time_utils import time_fn
+
+GRID_SIZES = [0.0025, 0.001, 0.0005]  # m
+BUILDERS = ["recursive", "frontier"]
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(
+        description="Compares SurfaceGridMap builders on the surface scan"
+    )
+    argparser.add_argument("--repeat", type=int, default=3)
+    argparser.add_argument(
+        "--grid_sizes", type=float, nargs="+", default=GRID_SIZES, help="grid sizes (m)"
+    )
+    argparser.add_argument(
+        "--recursion_limit",
+        type=int,
+        default=None,
+        help="raise python's recursion limit for the recursive builder",
+    )
+    args = argparser.parse_args()
+
+    if args.recursion_limit is not None:
+        sys.setrecursionlimit(args.recursion_limit)
+
+    pcd = o3d.io.read_point_cloud(str(rpal_const.SURFACE_SCAN_PATH))
+    surface_mesh = scan2mesh(pcd)
+    roi_pcd = mesh2roi(surface_mesh, bbox_pts=rpal_const.BBOX_ROI)
+
+    print(f"{'grid_size (mm)':>15} {'builder':>10} {'cells':>8} {'mean (s)':>10} {'min (s)':>10}")
+    for grid_size in args.grid_sizes:
+        for builder in BUILDERS:
+            grids = []
+
+            def build():
+                grids.append(
+                    SurfaceGridMap(copy.deepcopy(roi_pcd), grid_size=grid_size, builder=builder)
+                )
+
+            try:
+                durations = time_fn(build, repeat=args.repeat)
+            except RecursionError:
+                print(f"{grid_size * 1000:>15.1f} {builder:>10} {'RecursionError':>30}")
+                continue
+            print(
+                f"{grid_size * 1000:>15.1f} {builder:>10} {len(grids[-1].cell_idx2grid_idx):>8}"
+                f" {np.mean(durations):>10.4f} {np.min(durations):>10.4f}"
+            )
@@ -0,0 +1,247 @@
+import argparse
+import json
+import platform
+import sys
+import tempfile
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import open3d as o3d
+
+from rpal.algorithms.bayesian_optimization import BayesianOptimization
+from rpal.algorithms.gp import SquaredExpKernel, gp_posterior
+from rpal.algorithms.grid import GridMap2D, SurfaceGridMap
+from rpal.algorithms.search import SearchHistory
+from rpal.utils.constants import PALP_CONST
+from rpal.utils.eval_utils import f_score_curve
+from rpal.utils.time_utils import time_fn
+
+GRID_SIDES = [10, 20, 50, 100, 200, 500]  # cells per side, 10^2 - 500^2 cells
+OBS_COUNTS = [10, 30, 100, 300, 1000]
+BUDGET_MS = 1000 / PALP_CONST.ctrl_freq  # one control period
+KERNEL_SCALE = PALP_CONST.kernel_scale
+
+
+def _observe(grid, n_obs, rng):
+    """marks n_obs random distinct cells of grid as visited with random values"""
+    states = grid.vectorized_states.reshape(-1, 2)
+    for state in states[rng.choice(len(states), n_obs, replace=False)]:
+        grid.update(tuple(state), rng.uniform())
+    return grid
+
+
+def bench_gp_posterior(side, n_obs, rng):
+    grid = _observe(GridMap2D(side, side), n_obs, rng)
+    X = grid.X_visited
+    y = grid.grid[X[:, 0], X[:, 1]]
+    kernel = SquaredExpKernel(scale=KERNEL_SCALE)
+    return lambda: gp_posterior(grid.vectorized_states, X, y, kernel)
+
+
+def bench_bo_optimal_state(side, n_obs, rng):
+    grid = _observe(GridMap2D(side, side), n_obs, rng)
+    bo = BayesianOptimization(grid, SquaredExpKernel(scale=KERNEL_SCALE))
+    bo.update_gp()
+    return bo.get_optimal_state
+
+
+def bench_unvisited_states(side, n_obs, rng):
+    """one palpation's update followed by the unvisited states query"""
+    grid = _observe(GridMap2D(side, side), n_obs, rng)
+    unvisited = grid.unvisited_states().reshape(-1, 2)
+    queue = iter(unvisited[rng.permutation(len(unvisited))])
+
+    def step():
+        grid.update(tuple(next(queue)), rng.uniform())
+        grid.unvisited_states()
+
+    return step
+
+
+def bench_surface_grid_map(side, n_obs, rng, grid_size=PALP_CONST.grid_size):
+    """grid construction on a bumpy synthetic surface spanning side x side cells"""
+    xs = np.linspace(0, side * grid_size, 3 * side)
+    X, Y = np.meshgrid(xs, xs)
+    Z = 0.002 * np.sin(X / 0.01) * np.cos(Y / 0.01)
+    points = np.stack([X.ravel(), Y.ravel(), Z.ravel()], axis=1)
+
+    def build():
+        pcd = o3d.geometry.PointCloud()
+        pcd.points = o3d.utility.Vector3dVector(points)
+        SurfaceGridMap(pcd, grid_size=grid_size, max_r=side, max_c=side)
+
+    return build
+
+
+def bench_f_score(side, n_obs, rng):
+    """f_score_curve, the core of compute_f_score, on side^2 points per cloud"""
+    points_gt = rng.normal(scale=0.01, size=(side**2, 3))
+    points_rec = points_gt + rng.normal(scale=0.001, size=points_gt.shape)
+    return lambda: f_score_curve(points_gt, points_rec, [0.002])
+
+
+def bench_search_history_save(side, n_obs, rng):
+    history = SearchHistory()
+    grid = np.zeros((side, side))
+    for i in range(n_obs):
+        grid[rng.integers(side), rng.integers(side)] = rng.uniform()
+        history.add((i % side, i % side), grid)
+    # removed once the timed callable is dropped
+    tmp_dir = tempfile.TemporaryDirectory()
+    return lambda: history.save(Path(tmp_dir.name))
+
+
+# name -> (setup returning the timed callable, sweeps observation counts, bytes estimate)
+BENCHMARKS = {
+    "gp_posterior": (bench_gp_posterior, True, lambda c, n: 3 * 8 * c * n),
+    "bo_optimal_state": (bench_bo_optimal_state, True, lambda c, n: 3 * 8 * c * n),
+    "unvisited_states": (bench_unvisited_states, True, lambda c, n: 40 * c),
+    "surface_grid_map": (bench_surface_grid_map, False, lambda c, n: 2000 * c),
+    "f_score": (bench_f_score, False, lambda c, n: 200 * c),
+    "search_history_save": (bench_search_history_save, True, lambda c, n: 8 * c * n),
+}
+
+
+def crossings(rows, budget_ms):
+    """
+    cells at which the median time crosses budget_ms, per observation count, as
+    {"cells", "interpolated"}. Interpolated log-log between the last sweep point
+    under and the first over budget. When already over at the smallest measured
+    grid, cells is that grid and only an upper bound. None if never crossed.
+    """
+    out = {}
+    for n_obs in sorted({r["obs"] for r in rows}, key=lambda n: n or 0):
+        pts = sorted(
+            (r["cells"], r["median_ms"]) for r in rows if r["obs"] == n_obs
+        )
+        crossing = None
+        for (c0, t0), (c1, t1) in zip([(None, None)] + pts[:-1], pts):
+            if t1 <= budget_ms:
+                continue
+            if c0 is None:
+                crossing = dict(cells=c1, interpolated=False)
+            else:
+                w = (np.log(budget_ms) - np.log(t0)) / (np.log(t1) - np.log(t0))
+                cells = int(np.exp(np.log(c0) + w * (np.log(c1) - np.log(c0))))
+                crossing = dict(cells=cells, interpolated=True)
+            break
+        out[str(n_obs)] = crossing
+    return out
+
+
+def compare(results, baseline, tolerance):
+    """(bench, cells, obs, ratio) of sweep points slower than baseline by > tolerance"""
+    regressions = []
+    for name, rows in results.items():
+        base = {(r["cells"], r["obs"]): r for r in baseline.get(name, [])}
+        for r in rows:
+            b = base.get((r["cells"], r["obs"]))
+            if b is None:
+                continue
+            ratio = r["median_ms"] / b["median_ms"]
+            if ratio > 1 + tolerance:
+                regressions.append((name, r["cells"], r["obs"], ratio))
+    return regressions
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(
+        description="Times the planner hot paths across grid sizes and observation counts"
+    )
+    argparser.add_argument(
+        "--benchmarks", type=str, nargs="+", default=list(BENCHMARKS.keys())
+    )
+    argparser.add_argument("--sides", type=int, nargs="+", default=GRID_SIDES)
+    argparser.add_argument("--obs", type=int, nargs="+", default=OBS_COUNTS)
+    argparser.add_argument("--repeat", type=int, default=5)
+    argparser.add_argument("--seed", type=int, default=0)
+    argparser.add_argument(
+        "--max_bytes",
+        type=float,
+        default=2**31,
+        help="skip sweep points estimated to need more memory",
+    )
+    argparser.add_argument(
+        "--max_grid_build_cells",
+        type=int,
+        default=200**2,
+        help="largest grid for surface_grid_map, which scales with the scan size",
+    )
+    argparser.add_argument("--out", type=str, default="planner_benchmark.json")
+    argparser.add_argument("--baseline", type=str, default=None)
+    argparser.add_argument(
+        "--tolerance", type=float, default=0.2, help="allowed slowdown vs baseline"
+    )
+    argparser.add_argument("--budget_ms", type=float, default=BUDGET_MS)
+    args = argparser.parse_args()
+
+    results = {}
+    print(f"{'benchmark':>20} {'cells':>8} {'obs':>6} {'median (ms)':>12} {'min (ms)':>10}")
+    for name in args.benchmarks:
+        setup, sweeps_obs, est_bytes = BENCHMARKS[name]
+        rows = []
+        for side in args.sides:
+            cells = side**2
+            if name == "surface_grid_map" and cells > args.max_grid_build_cells:
+                continue
+            for n_obs in args.obs if sweeps_obs else [None]:
+                if n_obs is not None and n_obs >= cells:
+                    continue
+                if est_bytes(cells, n_obs or 1) > args.max_bytes:
+                    print(f"{name:>20} {cells:>8} {n_obs or '-':>6} {'skipped':>12}")
+                    continue
+                rng = np.random.default_rng(args.seed)
+                fn = setup(side, n_obs, rng)
+                durations = np.array(time_fn(fn, repeat=args.repeat, warmup=1)) * 1e3
+                rows.append(
+                    dict(
+                        cells=cells,
+                        obs=n_obs,
+                        median_ms=float(np.median(durations)),
+                        min_ms=float(durations.min()),
+                    )
+                )
+                print(
+                    f"{name:>20} {cells:>8} {n_obs or '-':>6}"
+                    f" {rows[-1]['median_ms']:>12.3f} {rows[-1]['min_ms']:>10.3f}"
+                )
+        results[name] = rows
+
+    print(f"\ncells at which the median crosses the {args.budget_ms:.1f} ms budget")
+    budget = {}
+    for name, rows in results.items():
+        budget[name] = crossings(rows, args.budget_ms)
+        for n_obs, crossing in budget[name].items():
+            obs = "-" if n_obs == "None" else n_obs
+            if crossing is None:
+                at = "never"
+            elif crossing["interpolated"]:
+                at = crossing["cells"]
+            else:
+                at = f"<= {crossing['cells']}"
+            print(f"{name:>20} obs {obs:>6}: {at}")
+
+    report = dict(
+        created=datetime.now().isoformat(timespec="seconds"),
+        machine=platform.platform(),
+        python=platform.python_version(),
+        numpy=np.__version__,
+        repeat=args.repeat,
+        budget_ms=args.budget_ms,
+        results=results,
+        budget_crossing_cells=budget,
+    )
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"saved {args.out}")
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.tolerance)
+        for name, cells, n_obs, ratio in regressions:
+            print(f"REGRESSION {name} cells {cells} obs {n_obs}: {ratio:.2f}x baseline")
+        if len(regressions) > 0:
+            sys.exit(1)
+        print(f"no regressions beyond {args.tolerance:.0%} of {args.baseline}")
@@ -0,0 +1,64 @@
+import argparse
+import multiprocessing as mp
+import time
+
+import numpy as np
+
+import rpal.utils.constants as rpal_const
+from rpal.utils.proc_utils import SharedRingBuffer
+
+
+def producer(name, capacity, n_samples, rate, start_event):
+    ring = SharedRingBuffer.attach(name, rpal_const.PALP_DTYPE, capacity)
+    record = np.zeros(1, dtype=rpal_const.PALP_DTYPE)[0]
+    start_event.wait()
+    period = 0.0 if rate is None else 1.0 / rate
+    next_t = time.perf_counter()
+    for i in range(n_samples):
+        record["palp_id"] = i
+        ring.push(record)
+        if period > 0:
+            next_t += period
+            while time.perf_counter() < next_t:
+                pass
+    ring.close()
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(
+        description="Throughput of the ctrl -> logger shared-memory ring buffer"
+    )
+    argparser.add_argument("--samples", type=int, default=200000)
+    argparser.add_argument("--capacity", type=int, default=rpal_const.PALP_CONST.ring_buffer_size)
+    argparser.add_argument(
+        "--rate", type=float, default=None, help="producer rate in Hz, unlimited if unset"
+    )
+    argparser.add_argument("--drain_hz", type=float, default=50.0, help="consumer poll rate")
+    args = argparser.parse_args()
+
+    ring = SharedRingBuffer(rpal_const.PALP_DTYPE, capacity=args.capacity)
+    start_event = mp.Event()
+    proc = mp.Process(
+        target=producer,
+        args=(ring.name, args.capacity, args.samples, args.rate, start_event),
+    )
+    proc.start()
+
+    received = []
+    drains = 0
+    start_event.set()
+    start = time.perf_counter()
+    while proc.is_alive() or len(ring) > 0:
+        samples = ring.drain()
+        drains += 1
+        received.append(samples["palp_id"])
+        time.sleep(1 / args.drain_hz)
+    elapsed = time.perf_counter() - start
+    proc.join()
+
+    ids = np.concatenate(received)
+    in_order = np.all(np.diff(ids) > 0)
+    print(f"pushed {args.samples}, received {len(ids)}, dropped {ring.dropped}")
+    print(f"received exactly once and in order: {in_order and len(np.unique(ids)) == len(ids)}")
+    print(f"{len(ids) / elapsed:.0f} samples/s over {elapsed:.2f}s, {len(ids) / drains:.1f} per drain")
+    ring.close()
@@ -0,0 +1,227 @@
+import os
+
+# one BLAS thread per worker, the pool provides the parallelism
+os.environ.setdefault("OMP_NUM_THREADS", "1")
+
+import argparse
+import contextlib
+import io
+import multiprocessing as mp
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import open3d as o3d
+import yaml
+
+import rpal.utils.constants as rpal_const
+from rpal.algorithms.grid import SurfaceGridMap, cached_surface_grid_map
+from rpal.algorithms.search import (
+    ActiveSearchAlgos,
+    ActiveSearchWithRandomInit,
+    RandomSearch,
+)
+from rpal.utils.constants import PALP_CONST
+
+ALGOS = ["random", "bo"]
+KERNEL_SCALES = [1, 2, 4]  # normalized grid space units
+TISSUE_STIFFNESS = 800.0 / PALP_CONST.stiffness_normalization
+TUMOR_STIFFNESS = 2500.0 / PALP_CONST.stiffness_normalization
+PERCENTILES = [50, 90, 99]
+
+_GRID = None
+
+
+def _init_worker(grid_path):
+    global _GRID
+    _GRID = SurfaceGridMap.load(grid_path)
+
+
+def synthetic_stiffness_field(grid, rng, radius_range=(2.0, 5.0)):
+    """
+    Normalized stiffness over grid with one elliptical tumour of random center,
+    radii (grid cells) and orientation. Returns the field and the tumour mask, both
+    of grid.shape.
+    """
+    states = grid.vectorized_states.reshape(-1, 2)
+    center = states[rng.integers(len(states))]
+    radii = rng.uniform(*radius_range, size=2)
+    angle = rng.uniform(0, np.pi)
+    R = np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
+
+    d = (states - center) @ R / radii
+    tumor = np.zeros(grid.shape, dtype=bool)
+    tumor[states[:, 0], states[:, 1]] = np.sum(d**2, axis=1) <= 1
+    field = np.where(tumor, TUMOR_STIFFNESS, TISSUE_STIFFNESS)
+    return field, tumor
+
+
+def make_search(algo, grid, kernel_scale):
+    if algo == "bo":
+        return ActiveSearchWithRandomInit(
+            ActiveSearchAlgos.BO,
+            grid,
+            kernel_scale=kernel_scale,
+            random_sample_count=PALP_CONST.random_sample_count,
+        )
+    elif algo == "random":
+        return RandomSearch(grid)
+    raise RuntimeError(f"Invalid algo {algo}!")
+
+
+def run_trial(algo, kernel_scale, seed, max_palpations, noise_std):
+    """runs one search against a fresh synthetic field, returns its metrics"""
+    grid = _GRID
+    grid.reset()
+    rng = np.random.default_rng(seed)
+    field, tumor = synthetic_stiffness_field(grid, rng)
+    # the searches draw from the global generator
+    np.random.seed(seed)
+    search = make_search(algo, grid, kernel_scale)
+
+    latencies = np.zeros(max_palpations)
+    palpations_to_detect = None
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i in range(max_palpations):
+            start = time.perf_counter()
+            pt, _ = search.next()
+            latencies[i] = time.perf_counter() - start
+
+            idx = grid.pt_to_idx(pt)
+            value = field[idx] + rng.normal(0, noise_std)
+
+            start = time.perf_counter()
+            search.update_outcome(value)
+            latencies[i] += time.perf_counter() - start
+
+            if palpations_to_detect is None and tumor[idx]:
+                palpations_to_detect = i + 1
+        _, estimate = search.grid_estimate
+
+    states = grid.vectorized_states.reshape(-1, 2)
+    truth = tumor[states[:, 0], states[:, 1]]
+    pred = estimate[states[:, 0], states[:, 1]] > PALP_CONST.stiffness_tumor_filter
+    tp = np.sum(pred & truth)
+    precision = tp / max(np.sum(pred), 1)
+    recall = tp / max(np.sum(truth), 1)
+    return dict(
+        algo=algo,
+        kernel_scale=kernel_scale,
+        seed=seed,
+        precision=float(precision),
+        recall=float(recall),
+        f1=float(2 * precision * recall / max(precision + recall, 1e-12)),
+        iou=float(tp / max(np.sum(pred | truth), 1)),
+        palpations_to_detect=palpations_to_detect,
+        latencies=latencies,
+    )
+
+
+def summarize(trials):
+    latencies = np.concatenate([t["latencies"] for t in trials]) * 1e3
+    detect = [t["palpations_to_detect"] for t in trials if t["palpations_to_detect"]]
+    summary = dict(
+        trials=len(trials),
+        f1=float(np.mean([t["f1"] for t in trials])),
+        f1_std=float(np.std([t["f1"] for t in trials])),
+        iou=float(np.mean([t["iou"] for t in trials])),
+        detect_rate=len(detect) / len(trials),
+        palpations_to_detect=float(np.median(detect)) if detect else None,
+        latency_ms_max=float(latencies.max()),
+    )
+    for q, v in zip(PERCENTILES, np.percentile(latencies, PERCENTILES)):
+        summary[f"latency_ms_p{q}"] = float(v)
+    return summary
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(
+        description="Monte-Carlo comparison of search policies on synthetic stiffness fields"
+    )
+    argparser.add_argument("--algos", type=str, nargs="+", default=ALGOS)
+    argparser.add_argument(
+        "--kernel_scales", type=float, nargs="+", default=KERNEL_SCALES
+    )
+    argparser.add_argument("--trials", type=int, default=50, help="seeds per config")
+    argparser.add_argument("--seed", type=int, default=0, help="first seed")
+    argparser.add_argument(
+        "--max_palpations", type=int, default=PALP_CONST.max_palpations
+    )
+    argparser.add_argument(
+        "--noise_std", type=float, default=0.03, help="normalized stiffness noise"
+    )
+    argparser.add_argument("--grid_size", type=float, default=PALP_CONST.grid_size)
+    argparser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count(),
+        help="trials run in parallel, 1 runs in this process",
+    )
+    argparser.add_argument(
+        "--out", type=str, default="search_benchmark.yml", help="summary file"
+    )
+    args = argparser.parse_args()
+
+    pcd = o3d.io.read_point_cloud(str(rpal_const.SURFACE_SCAN_PATH))
+    grid = cached_surface_grid_map(
+        pcd, rpal_const.BBOX_DOCTOR_ROI, grid_size=args.grid_size
+    )
+    print(f"grid {grid.shape}, {len(grid.vectorized_states)} cells")
+
+    jobs = []
+    for algo in args.algos:
+        # random search ignores the kernel
+        scales = args.kernel_scales if algo == "bo" else [None]
+        for kernel_scale in scales:
+            for seed in range(args.seed, args.seed + args.trials):
+                jobs.append(
+                    (algo, kernel_scale, seed, args.max_palpations, args.noise_std)
+                )
+
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        grid_path = Path(tmp_dir) / "grid.npz"
+        grid.save(grid_path)
+        if args.workers <= 1:
+            _init_worker(grid_path)
+            trials = [run_trial(*job) for job in jobs]
+        else:
+            with mp.Pool(
+                args.workers, initializer=_init_worker, initargs=(grid_path,)
+            ) as pool:
+                trials = pool.starmap(run_trial, jobs, chunksize=4)
+    print(f"{len(trials)} trials in {time.perf_counter() - start:.1f} s")
+
+    configs = {}
+    for t in trials:
+        configs.setdefault((t["algo"], t["kernel_scale"]), []).append(t)
+    results = []
+    for (algo, kernel_scale), group in configs.items():
+        results.append(dict(algo=algo, kernel_scale=kernel_scale, **summarize(group)))
+
+    print(
+        f"{'algo':>8} {'kernel':>7} {'f1':>12} {'iou':>6} {'detect':>7} {'palps':>6}"
+        f" {'p50 (ms)':>9} {'p99 (ms)':>9} {'max (ms)':>9}"
+    )
+    for r in results:
+        kernel = "-" if r["kernel_scale"] is None else f"{r['kernel_scale']:g}"
+        palps = "-" if r["palpations_to_detect"] is None else r["palpations_to_detect"]
+        print(
+            f"{r['algo']:>8} {kernel:>7} {r['f1']:>6.3f}±{r['f1_std']:<5.3f}"
+            f" {r['iou']:>6.3f} {r['detect_rate']:>7.2f} {palps:>6}"
+            f" {r['latency_ms_p50']:>9.3f} {r['latency_ms_p99']:>9.3f}"
+            f" {r['latency_ms_max']:>9.3f}"
+        )
+
+    yaml.dump(
+        dict(
+            max_palpations=args.max_palpations,
+            noise_std=args.noise_std,
+            grid_size=args.grid_size,
+            results=results,
+        ),
+        open(args.out, "w"),
+        sort_keys=False,
+    )
+    print(f"saved {args.out}")
@@ -1,7 +1,6 @@
 """Generate camera calibration dataset for https://github.com/ToyotaResearchInstitute/handical"""
 import argparse
 import multiprocessing as mp
-from multiprocessing import shared_memory
 
 import cv2
 import numpy as np
@@ -15,14 +14,14 @@ import rpal.utils.constants as rpal_const
 from rpal.utils.data_utils import CalibrationWriter
 from rpal.utils.devices import RealsenseCapture
 from rpal.utils.keystroke_counter import KeyCode, KeystrokeCounter
+from rpal.utils.proc_utils import SharedArray, wait_until
 from rpal.utils.time_utils import Ratekeeper
 
 PROPRIO_DIM = 7  # pos: x,y,z, rot: x,y,z,w
 
 
 def deoxys_ctrl(shm_posearr_name, stop_event):
-    existing_shm = shared_memory.SharedMemory(name=shm_posearr_name)
-    O_T_EE = np.ndarray(PROPRIO_DIM, dtype=np.float32, buffer=existing_shm.buf)
+    O_T_EE_shared = SharedArray.attach(shm_posearr_name, PROPRIO_DIM, dtype=np.float32)
     robot_interface = FrankaInterface(
         str(rpal_const.PAN_PAN_FORCE_CFG),
         use_visualizer=False,
@@ -35,13 +34,15 @@ def deoxys_ctrl(shm_posearr_name, stop_event):
     )
     device.start_control()
 
-    while len(robot_interface._state_buffer) == 0:
-        continue
+    wait_until(
+        lambda: len(robot_interface._state_buffer) > 0,
+        timeout=rpal_const.STARTUP_TIMEOUT,
+        name="robot state",
+    )
 
     while not stop_event.is_set():
         q, p = robot_interface.last_eef_quat_and_pos
-        O_T_EE[:3] = p.flatten()
-        O_T_EE[3:7] = q.flatten()
+        O_T_EE_shared.write(np.concatenate([p.flatten(), q.flatten()]))
 
         action, grasp = input2action(
             device=device,
@@ -62,8 +63,7 @@ def deoxys_ctrl(shm_posearr_name, stop_event):
     )
     robot_interface.close()
 
-    existing_shm.close()
-    existing_shm.unlink()
+    O_T_EE_shared.close()
 
 
 if __name__ == "__main__":
@@ -71,11 +71,9 @@ if __name__ == "__main__":
     argparser.add_argument("--interface-cfg", type=str, default="pan-pan-force.yml")
     args = argparser.parse_args()
 
-    O_T_EE = np.zeros(PROPRIO_DIM, dtype=np.float32)
-    shm = shared_memory.SharedMemory(create=True, size=O_T_EE.nbytes)
-    O_T_EE = np.ndarray(O_T_EE.shape, dtype=O_T_EE.dtype, buffer=shm.buf)
+    O_T_EE_shared = SharedArray(PROPRIO_DIM, dtype=np.float32)
     stop_event = mp.Event()
-    ctrl_process = mp.Process(target=deoxys_ctrl, args=(shm.name, stop_event))
+    ctrl_process = mp.Process(target=deoxys_ctrl, args=(O_T_EE_shared.name, stop_event))
     ctrl_process.start()
 
     rs = RealsenseCapture()
@@ -88,14 +86,14 @@ if __name__ == "__main__":
     )
     im, pcd = rs.read()
 
+    print("Waiting for pose...")
+    O_T_EE_shared.wait(timeout=rpal_const.STARTUP_TIMEOUT)
     rk = Ratekeeper(30)
 
     with KeystrokeCounter() as key_counter:
         try:
             while 1:
-                if np.all(O_T_EE == 0):
-                    print("Waiting for pose...")
-                    continue
+                O_T_EE = O_T_EE_shared.read()
                 im, new_pcd = rs.read()
 
                 press_events = key_counter.get_press_events()
@@ -124,5 +122,4 @@ if __name__ == "__main__":
 
         calibration_writer.write()
 
-        shm.close()
-        shm.unlink()
+        O_T_EE_shared.close()
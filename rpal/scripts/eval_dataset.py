@@ -3,6 +3,7 @@ from collections import defaultdict
 import numpy as np
 import argparse
 import glob
+import multiprocessing as mp
 from rpal.utils.constants import *
 from rpal.utils.transform_utils import quat2mat
 from rpal.utils.pcd_utils import (
@@ -10,16 +11,18 @@ from rpal.utils.pcd_utils import (
     mesh2roi,
     visualize_pcds,
     color_icp,
-    color_filter,
     mesh2polyroi,
     pick_surface_bbox,
     stl_to_pcd,
     color_entity,
     disk_pcd,
-    clustering,
-    inverse_crop,
+    mesh_from_arrays,
+    mesh_to_arrays,
+    cached_ground_truth_tumors,
 )
 from rpal.algorithms.gui import HeatmapAnimation
+from rpal.algorithms.search import load_search_history
+from rpal.utils.eval_utils import f_score_curve
 import copy
 import matplotlib
 from datetime import datetime
@@ -36,6 +39,7 @@ norm = matplotlib.colors.Normalize(
 )
 TUMOR_ID = {"hemisphere": 2, "crescent": 3}
 TAU = 3e-3
+TAUS = np.array([1e-3, 2e-3, 3e-3, 4e-3, 5e-3])
 ALGOS = ["bo", "random"]
 
 # set to None if you want to reselect crop polygon geometry
@@ -98,9 +102,7 @@ EVAL_CROP = {
 }
 
 
-def compute_f_score(mesh_gt, mesh_reconstructed):
-    tau = TAU
-
+def compute_f_score_curve(mesh_gt, mesh_reconstructed, taus=TAUS, visualize=False):
     def center_mesh(mesh):
         m = copy.deepcopy(mesh)
         center = m.get_center()
@@ -116,37 +118,234 @@ def compute_f_score(mesh_gt, mesh_reconstructed):
 
     pcd_gt = preprocess(mesh_gt)
     pcd_reconstructed = preprocess(mesh_reconstructed)
-    o3d.visualization.draw_geometries([pcd_gt, pcd_reconstructed])
-    # Convert to numpy arrays for distance computation
-    points_gt = np.asarray(pcd_gt.points)
-    points_reconstructed = np.asarray(pcd_reconstructed.points)
+    if visualize:
+        o3d.visualization.draw_geometries([pcd_gt, pcd_reconstructed])
 
-    # Compute distances for precision
-    dists_precision = o3d.geometry.KDTreeFlann(pcd_gt)
-    precision_count = 0
-    for point in points_reconstructed:
-        _, _, dist = dists_precision.search_knn_vector_3d(point, 1)
-        if np.sqrt(dist[0]) < tau:
-            precision_count += 1
-    precision = precision_count / len(points_reconstructed)
+    return f_score_curve(
+        np.asarray(pcd_gt.points), np.asarray(pcd_reconstructed.points), taus
+    )
 
-    # Compute distances for recall
-    dists_recall = o3d.geometry.KDTreeFlann(pcd_reconstructed)
-    recall_count = 0
-    for point in points_gt:
-        _, _, dist = dists_recall.search_knn_vector_3d(point, 1)
-        if np.sqrt(dist[0]) < tau:
-            recall_count += 1
-    recall = recall_count / len(points_gt)
 
-    # Compute F-score
-    f_score = (
-        2 * (precision * recall) / (precision + recall)
-        if (precision + recall) > 0
-        else 0
+def compute_f_score(mesh_gt, mesh_reconstructed, visualize=False):
+    _, _, f_score = compute_f_score_curve(
+        mesh_gt, mesh_reconstructed, taus=[TAU], visualize=visualize
     )
+    return f_score[0]
+
+
+# ground truth tumour meshes, built once by the parent and set per worker
+_GT_TUMOR_MESHES = None
+
+
+def _init_worker(gt_mesh_arrays):
+    global _GT_TUMOR_MESHES
+    _GT_TUMOR_MESHES = [mesh_from_arrays(*arrays) for arrays in gt_mesh_arrays]
 
-    return f_score
+
+def evaluate_dataset(dataset_path, combine=False, visualize=False, rerun=False):
+    """Evaluates one dataset folder, writing f_score.yaml and meshes to its eval folder.
+
+    Returns the f-scores for aggregation, or the reconstruction points when combining.
+    """
+    print(f"Evaluating {dataset_path.name}")
+    palpations_cnt = 0
+
+    tumor_pcd_without_CF = o3d.geometry.PointCloud()
+    save_path = RPAL_MESH_PATH.parent / "eval" / f"eval_{dataset_path.name}"
+    save_path.mkdir(parents=True, exist_ok=True)
+    search_history = load_search_history(dataset_path)
+    if rerun:
+        ani = HeatmapAnimation(search_history)
+        ani.visualize()
+    timeseries = np.load(dataset_path / "timeseries.npy")
+    palpations_cnt += timeseries[:]["palp_id"].max()
+    roi_pcd = o3d.io.read_point_cloud(str(dataset_path / "roi.ply"))
+    grid_pcd = o3d.io.read_point_cloud(str(dataset_path / "grid.ply"))
+    recon_pth = dataset_path / "reconstruction.ply"
+    tumor_pcd_with_CF = o3d.io.read_point_cloud(str(recon_pth))
+    tumor_pcd_with_CF = color_entity(tumor_pcd_with_CF)
+
+    # ground truth init
+    cfg = yaml.safe_load(open(str(dataset_path / "config.yml")))
+    tumor_type = cfg["tumor_type"]
+    algo = cfg["algo"]
+    result = {"dataset": dataset_path.name, "tumor_type": tumor_type, "algo": algo}
+    if combine:
+        result["recon_points"] = np.asarray(tumor_pcd_with_CF.points)
+        result["recon_colors"] = np.asarray(tumor_pcd_with_CF.colors)
+        return result
+    print(f"Evaluating tumor {tumor_type}")
+    ground_truth_mesh_scan = _GT_TUMOR_MESHES[TUMOR_ID[tumor_type]]
+
+    # log data
+    if rerun:
+        rr.log(
+            "pcds/ground_truth_tumor",
+            pcd_to_rr(
+                "gt_tumor",
+                np.asarray(gt_tumor.points),
+                colors=np.asarray(gt_tumor.colors),
+            ),
+        )
+        rr.log(
+            f"pcds/grid/{dataset_path.name}",
+            pcd_to_rr("grid", np.asarray(grid_pcd.points)),
+        )
+        rr.log(
+            f"pcds/roi/{dataset_path.name}",
+            pcd_to_rr("roi", np.asarray(roi_pcd.points)),
+        )
+        recon_np = np.asarray(reconstruction_pcd.points)
+        rr.log(
+            f"pcds/reconstructed_tumor/{dataset_path.name}",
+            pcd_to_rr(
+                "recon_tumor",
+                recon_np,
+                colors=np.asarray(reconstruction_pcd.colors),
+            ),
+        )
+    collect_pts = timeseries[:]["collect_points_flag"]
+    collect_pts_t, _ = np.where(collect_pts == 1)
+    O_p_E = timeseries[collect_pts_t]["O_p_EE"]
+    O_q_E = timeseries[collect_pts_t]["O_q_EE"]
+    init_O_p_surf = False
+    init_O_p_f = False
+
+    Fxyz = timeseries[:]["Fxyz"]
+    O_p_E = timeseries[:]["O_p_EE"]
+    using_force_control_flag = timeseries[:]["using_force_control_flag"]
+    palp_state = timeseries[:]["palp_state"]
+
+    O_p_surf_t = np.where(np.diff(timeseries[:]["palp_id"], axis=0) == 1)[0]
+    O_p_surf = np.einsum("ijk->ik", timeseries[O_p_surf_t]["O_p_EE"])
+    O_p_f_t = np.where(
+        np.diff(timeseries[:]["using_force_control_flag"], axis=0) == 1
+    )[0]
+    O_p_f = np.einsum("ijk->ik", timeseries[O_p_f_t]["O_p_EE"])
+    if O_p_f.shape == O_p_surf.shape:
+        stiffness_fz = Fxyz[O_p_f_t, 0, 2] / (
+            np.linalg.norm(O_p_f - O_p_surf) + 1e-6
+        )
+        stiffness_fz /= 3000
+        gradients = stiffness_fz
+        assert (
+            np.max(gradients) <= 1.0 and np.min(gradients) >= 0.0
+        ), "Gradients should be between 0 and 1: {}, {}".format(
+            np.max(gradients), np.min(gradients)
+        )
+        colors = cmap(norm(gradients))
+        final_pcd = o3d.geometry.PointCloud()
+        final_pcd.points = o3d.utility.Vector3dVector(O_p_f)
+        final_pcd.colors = o3d.utility.Vector3dVector(colors[:, :3])
+        tumor_pcd_without_CF += final_pcd
+        if rerun:
+            rr.log(
+                f"pcds/positioning_end/{dataset_path.name}",
+                pcd_to_rr("positioning_end", O_p_f, colors),
+            )
+    if rerun:
+        for t in range(len(timeseries)):
+            Fxyz = timeseries[t]["Fxyz"]
+            O_p_E = timeseries[t]["O_p_EE"]
+            O_q_E = timeseries[t]["O_q_EE"]
+            collect_pts_flag = timeseries[t]["collect_points_flag"]
+            using_force_control_flag = timeseries[t]["using_force_control_flag"]
+            palp_state = timeseries[t]["palp_state"]
+            palp_id = timeseries[t]["palp_id"]
+            stiffness_fz = 0
+            stiffness_exp = 0
+            if palp_state == PalpateState.PALPATE:
+                if not init_O_p_surf:
+                    O_p_surf = O_p_E
+                    init_O_p_surf = True
+                if using_force_control_flag and not init_O_p_f:
+                    O_p_f = O_p_E
+                    stiffness_fz = Fxyz[0, 2] / np.linalg.norm(O_p_f - O_p_surf)
+                    stiffness_fz /= PALP_CONST.stiffness_normalization
+                    # stiffness_exp = timeseries[t]["stiffness"]
+                    init_O_p_f = True
+                T = np.eye(4)
+                T[:3, :3] = quat2mat(O_q_E.flatten())
+                T[:3, 3] = O_p_E.flatten()
+                rr_tf = TranslationAndMat3x3(translation=T[:3, 3], mat3x3=T[:3, :3])
+                rr.log("pcds/eef_pose", rr.Transform3D(transform=rr_tf))
+                rr.log("force/x", rr.Scalar(Fxyz[0, 0]))
+                rr.log("force/y", rr.Scalar(Fxyz[0, 1]))
+                rr.log("force/z", rr.Scalar(Fxyz[0, 2]))
+                if collect_pts_flag:
+                    # rr.log("stiffness/experiment", rr.Scalar(stiffness_exp))
+                    rr.log("stiffness/Fz", rr.Scalar(stiffness_fz))
+            else:
+                init_O_p_surf = False
+                init_O_p_f = False
+            palp_id = min(len(search_history) - 1, palp_id)
+            grid = search_history[palp_id]["grid"]
+            rr.log("search_grid", rr.Tensor(grid, dim_names=("batch", "X", "Y")))
+
+    tumor_mesh_without_CF = mesh2polyroi(
+        color_entity(scan2mesh(tumor_pcd_without_CF)),
+        polybox_pts=EVAL_CROP[tumor_type],
+        return_mesh=True,
+    )
+    tumor_mesh_with_CF = mesh2polyroi(
+        color_entity(scan2mesh(tumor_pcd_with_CF)),
+        polybox_pts=EVAL_CROP[tumor_type],
+        return_mesh=True,
+    )
+    print(f"tumor_mesh_without_CF: {len(tumor_mesh_without_CF.vertices)}")
+    print(f"tumor_mesh_with_CF: {len(tumor_mesh_with_CF.vertices)}")
+    # compute f-scores
+    curve_without_CF = compute_f_score_curve(
+        ground_truth_mesh_scan, tumor_mesh_without_CF, visualize=visualize
+    )
+    curve_with_CF = compute_f_score_curve(
+        ground_truth_mesh_scan, tumor_mesh_with_CF, visualize=visualize
+    )
+    tau_i = np.flatnonzero(np.isclose(TAUS, TAU))[0]
+    f_score_without_CF = float(curve_without_CF[2][tau_i])
+    f_score_with_CF = float(curve_with_CF[2][tau_i])
+    # print(f"F-score sanity check: {f_score_sanity_check}")
+    print(f"F-score with CF: {f_score_with_CF}")
+    print(f"F-score without CF: {f_score_without_CF}")
+    yaml.dump(
+        {
+            "f_score_with_CF": f_score_with_CF,
+            "f_score_without_CF": f_score_without_CF,
+            "tau": TAU,
+            "curve": {
+                "taus": TAUS.tolist(),
+                "with_CF": {
+                    k: v.tolist()
+                    for k, v in zip(("precision", "recall", "f_score"), curve_with_CF)
+                },
+                "without_CF": {
+                    k: v.tolist()
+                    for k, v in zip(
+                        ("precision", "recall", "f_score"), curve_without_CF
+                    )
+                },
+            },
+        },
+        open(save_path / "f_score.yaml", "w"),
+    )
+
+    o3d.io.write_triangle_mesh(
+        str(save_path / "mesh_without_CF.ply"), tumor_mesh_without_CF
+    )
+    o3d.io.write_triangle_mesh(
+        str(save_path / "mesh_with_CF.ply"), tumor_mesh_with_CF
+    )
+    o3d.io.write_triangle_mesh(
+        str(save_path / "mesh_gt_scan.ply"), ground_truth_mesh_scan
+    )
+
+    if rerun:
+        for mesh in [tumor_mesh, tumor_mesh_with_CF, ground_truth_mesh_scan]:
+            mesh.compute_vertex_normals()
+            o3d.visualization.draw_geometries([mesh])
+    result["f_score_with_CF"] = f_score_with_CF
+    result["f_score_without_CF"] = f_score_without_CF
+    return result
 
 
 if __name__ == "__main__":
@@ -183,21 +382,26 @@ if __name__ == "__main__":
         default=False,
         help="Visualize with rerun",
     )
+    parser.add_argument(
+        "--visualize",
+        type=bool,
+        default=False,
+        help="Show the sampled point clouds for every f-score",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count(),
+        help="Datasets evaluated in parallel, 1 evaluates in this process",
+    )
     args = parser.parse_args()
 
     combined_tumor_recon = defaultdict(o3d.geometry.PointCloud)
-    gt_scan = o3d.io.read_point_cloud(str(GT_PATH))
-    gt_scan = color_filter(gt_scan, color_to_filter=[0.0, 0.0, 0.0], threshold=0.1)
-    gt_tumors = clustering(gt_scan, eps=0.002, min_points=50)
-    gt_tumors = sorted(gt_tumors, key=lambda pc: len(pc.points))
-
+    gt_tumors, gt_tumors_scan_mesh = cached_ground_truth_tumors(
+        GT_PATH, eps=0.002, min_points=50
+    )
     print("Found {} tumour clusters".format(len(gt_tumors)))
-    gt_tumors_scan_pcd = [
-        color_entity(gt_tumor, color_map="rainbow") for gt_tumor in gt_tumors
-    ]
-    gt_tumors_scan_mesh = [
-        color_entity(scan2mesh(gt_tumor)) for gt_tumor in gt_tumors_scan_pcd
-    ]
+    gt_mesh_arrays = [mesh_to_arrays(mesh) for mesh in gt_tumors_scan_mesh]
     dataset_map = {}
     final_fscores_map = defaultdict(list)
     datasets = []
@@ -210,7 +414,6 @@ if __name__ == "__main__":
                 )
                 datasets += [RPAL_DATA_PATH / s for s in sets]
 
-        f_scores = np.zeros((len(datasets), 2))
         print("Found {} datasets".format(len(datasets)))
     else:
         datasets = [RPAL_DATA_PATH / args.dataset_path]
@@ -218,194 +421,37 @@ if __name__ == "__main__":
     if rerun:
         print("Spawning rerun")
         rr.init("rpal_eval", spawn=True)
-    for i, dataset_path in enumerate(datasets):
-        print(f"Evaluating {dataset_path.name}")
-        palpations_cnt = 0
-
-        tumor_pcd_without_CF = o3d.geometry.PointCloud()
-        save_path = RPAL_MESH_PATH.parent / "eval" / f"eval_{dataset_path.name}"
-        save_path.mkdir(parents=True, exist_ok=True)
-        search_history = np.load(dataset_path / "search_history.npy")
-        if rerun:
-            ani = HeatmapAnimation(search_history)
-            ani.visualize()
-        timeseries = np.load(dataset_path / "timeseries.npy")
-        palpations_cnt += timeseries[:]["palp_id"].max()
-        roi_pcd = o3d.io.read_point_cloud(str(dataset_path / "roi.ply"))
-        grid_pcd = o3d.io.read_point_cloud(str(dataset_path / "grid.ply"))
-        recon_pth = dataset_path / "reconstruction.ply"
-        tumor_pcd_with_CF = o3d.io.read_point_cloud(str(recon_pth))
-        tumor_pcd_with_CF = color_entity(tumor_pcd_with_CF)
+    if rerun or args.workers <= 1:
+        _init_worker(gt_mesh_arrays)
+        results = [
+            evaluate_dataset(d, args.combine, args.visualize, rerun) for d in datasets
+        ]
+    else:
+        with mp.Pool(
+            args.workers, initializer=_init_worker, initargs=(gt_mesh_arrays,)
+        ) as pool:
+            results = pool.starmap(
+                evaluate_dataset,
+                [(d, args.combine, args.visualize, rerun) for d in datasets],
+            )
 
-        # ground truth init
-        cfg = yaml.safe_load(open(str(dataset_path / "config.yml")))
-        tumor_type = cfg["tumor_type"]
-        algo = cfg["algo"]
+    f_scores = np.zeros((len(datasets), 2))
+    for i, result in enumerate(results):
+        tumor_type, algo = result["tumor_type"], result["algo"]
         if args.combine:
-            combined_tumor_recon[TUMOR_ID[tumor_type]] += tumor_pcd_with_CF
+            recon_pcd = o3d.geometry.PointCloud()
+            recon_pcd.points = o3d.utility.Vector3dVector(result["recon_points"])
+            recon_pcd.colors = o3d.utility.Vector3dVector(result["recon_colors"])
+            combined_tumor_recon[TUMOR_ID[tumor_type]] += recon_pcd
             continue
-        print(f"Evaluating tumor {tumor_type}")
-        ground_truth_mesh_scan = gt_tumors_scan_mesh[TUMOR_ID[tumor_type]]
-        ground_truth_pcd_scan = gt_tumors[TUMOR_ID[tumor_type]]
-
-        # log data
-        if rerun:
-            rr.log(
-                "pcds/ground_truth_tumor",
-                pcd_to_rr(
-                    "gt_tumor",
-                    np.asarray(gt_tumor.points),
-                    colors=np.asarray(gt_tumor.colors),
-                ),
-            )
-            rr.log(
-                f"pcds/grid/{dataset_path.name}",
-                pcd_to_rr("grid", np.asarray(grid_pcd.points)),
-            )
-            rr.log(
-                f"pcds/roi/{dataset_path.name}",
-                pcd_to_rr("roi", np.asarray(roi_pcd.points)),
-            )
-            recon_np = np.asarray(reconstruction_pcd.points)
-            rr.log(
-                f"pcds/reconstructed_tumor/{dataset_path.name}",
-                pcd_to_rr(
-                    "recon_tumor",
-                    recon_np,
-                    colors=np.asarray(reconstruction_pcd.colors),
-                ),
-            )
-        collect_pts = timeseries[:]["collect_points_flag"]
-        collect_pts_t, _ = np.where(collect_pts == 1)
-        O_p_E = timeseries[collect_pts_t]["O_p_EE"]
-        O_q_E = timeseries[collect_pts_t]["O_q_EE"]
-        init_O_p_surf = False
-        init_O_p_f = False
-
-        Fxyz = timeseries[:]["Fxyz"]
-        O_p_E = timeseries[:]["O_p_EE"]
-        using_force_control_flag = timeseries[:]["using_force_control_flag"]
-        palp_state = timeseries[:]["palp_state"]
-
-        O_p_surf_t = np.where(np.diff(timeseries[:]["palp_id"], axis=0) == 1)[0]
-        O_p_surf = np.einsum("ijk->ik", timeseries[O_p_surf_t]["O_p_EE"])
-        O_p_f_t = np.where(
-            np.diff(timeseries[:]["using_force_control_flag"], axis=0) == 1
-        )[0]
-        O_p_f = np.einsum("ijk->ik", timeseries[O_p_f_t]["O_p_EE"])
-        if O_p_f.shape == O_p_surf.shape:
-            stiffness_fz = Fxyz[O_p_f_t, 0, 2] / (
-                np.linalg.norm(O_p_f - O_p_surf) + 1e-6
-            )
-            stiffness_fz /= 3000
-            gradients = stiffness_fz
-            assert (
-                np.max(gradients) <= 1.0 and np.min(gradients) >= 0.0
-            ), "Gradients should be between 0 and 1: {}, {}".format(
-                np.max(gradients), np.min(gradients)
-            )
-            colors = cmap(norm(gradients))
-            final_pcd = o3d.geometry.PointCloud()
-            final_pcd.points = o3d.utility.Vector3dVector(O_p_f)
-            final_pcd.colors = o3d.utility.Vector3dVector(colors[:, :3])
-            tumor_pcd_without_CF += final_pcd
-            if rerun:
-                rr.log(
-                    f"pcds/positioning_end/{dataset_path.name}",
-                    pcd_to_rr("positioning_end", O_p_f, colors),
-                )
-        if rerun:
-            for t in range(len(timeseries)):
-                Fxyz = timeseries[t]["Fxyz"]
-                O_p_E = timeseries[t]["O_p_EE"]
-                O_q_E = timeseries[t]["O_q_EE"]
-                collect_pts_flag = timeseries[t]["collect_points_flag"]
-                using_force_control_flag = timeseries[t]["using_force_control_flag"]
-                palp_state = timeseries[t]["palp_state"]
-                palp_id = timeseries[t]["palp_id"]
-                stiffness_fz = 0
-                stiffness_exp = 0
-                if palp_state == PalpateState.PALPATE:
-                    if not init_O_p_surf:
-                        O_p_surf = O_p_E
-                        init_O_p_surf = True
-                    if using_force_control_flag and not init_O_p_f:
-                        O_p_f = O_p_E
-                        stiffness_fz = Fxyz[0, 2] / np.linalg.norm(O_p_f - O_p_surf)
-                        stiffness_fz /= PALP_CONST.stiffness_normalization
-                        # stiffness_exp = timeseries[t]["stiffness"]
-                        init_O_p_f = True
-                    T = np.eye(4)
-                    T[:3, :3] = quat2mat(O_q_E.flatten())
-                    T[:3, 3] = O_p_E.flatten()
-                    rr_tf = TranslationAndMat3x3(translation=T[:3, 3], mat3x3=T[:3, :3])
-                    rr.log("pcds/eef_pose", rr.Transform3D(transform=rr_tf))
-                    rr.log("force/x", rr.Scalar(Fxyz[0, 0]))
-                    rr.log("force/y", rr.Scalar(Fxyz[0, 1]))
-                    rr.log("force/z", rr.Scalar(Fxyz[0, 2]))
-                    if collect_pts_flag:
-                        # rr.log("stiffness/experiment", rr.Scalar(stiffness_exp))
-                        rr.log("stiffness/Fz", rr.Scalar(stiffness_fz))
-                else:
-                    init_O_p_surf = False
-                    init_O_p_f = False
-                palp_id = min(len(search_history) - 1, palp_id)
-                grid = search_history[palp_id]["grid"]
-                rr.log("search_grid", rr.Tensor(grid, dim_names=("batch", "X", "Y")))
-
-        tumor_mesh_without_CF = mesh2polyroi(
-            color_entity(scan2mesh(tumor_pcd_without_CF)),
-            polybox_pts=EVAL_CROP[tumor_type],
-            return_mesh=True,
-        )
-        tumor_mesh_with_CF = mesh2polyroi(
-            color_entity(scan2mesh(tumor_pcd_with_CF)),
-            polybox_pts=EVAL_CROP[tumor_type],
-            return_mesh=True,
-        )
-        print(f"tumor_mesh_without_CF: {len(tumor_mesh_without_CF.vertices)}")
-        print(f"tumor_mesh_with_CF: {len(tumor_mesh_with_CF.vertices)}")
-        # compute f-scores
-        f_score_without_CF = compute_f_score(
-            ground_truth_mesh_scan, tumor_mesh_without_CF
-        )
-        f_score_with_CF = compute_f_score(ground_truth_mesh_scan, tumor_mesh_with_CF)
-        # print(f"F-score sanity check: {f_score_sanity_check}")
-        print(f"F-score with CF: {f_score_with_CF}")
-        print(f"F-score without CF: {f_score_without_CF}")
-        yaml.dump(
-            {
-                "f_score_with_CF": f_score_with_CF,
-                "f_score_without_CF": f_score_without_CF,
-                "tau": TAU,
-            },
-            open(save_path / "f_score.yaml", "w"),
-        )
-
-        o3d.io.write_triangle_mesh(
-            str(save_path / "mesh_without_CF.ply"), tumor_mesh_without_CF
-        )
-        o3d.io.write_triangle_mesh(
-            str(save_path / "mesh_with_CF.ply"), tumor_mesh_with_CF
-        )
-        o3d.io.write_triangle_mesh(
-            str(save_path / "mesh_gt_scan.ply"), ground_truth_mesh_scan
+        f_scores[i, 0] = result["f_score_with_CF"]
+        f_scores[i, 1] = result["f_score_without_CF"]
+        final_fscores_map[(tumor_type, algo)].append(i)
+    print(
+        "Found {} samples per category".format(
+            {k: len(v) for k, v in final_fscores_map.items()}
         )
-
-        if args.glob:
-            f_scores[i, 0] = f_score_with_CF
-            f_scores[i, 1] = f_score_without_CF
-            # if (input("Do you want to eval this run? (y/n) ") == "y"):
-            print(f"tumor {tumor_type}, algo {algo}")
-            final_fscores_map[(tumor_type, algo)].append(i)
-            print(
-                "current # of samples for this category: ",
-                len(final_fscores_map[(tumor_type, algo)]),
-            )
-        if rerun:
-            for mesh in [tumor_mesh, tumor_mesh_with_CF, ground_truth_mesh_scan]:
-                mesh.compute_vertex_normals()
-                o3d.visualization.draw_geometries([mesh])
+    )
     if args.combine:
         for tumor, i in TUMOR_ID.items():
             combined_mesh = color_entity(scan2mesh(combined_tumor_recon[i]))
@@ -413,8 +459,11 @@ if __name__ == "__main__":
                 combined_mesh, polybox_pts=EVAL_CROP[tumor], return_mesh=True
             )
             ground_truth_mesh_scan = gt_tumors_scan_mesh[i]
-            o3d.visualization.draw_geometries([combined_mesh_roi])
-            fscore = compute_f_score(ground_truth_mesh_scan, combined_mesh_roi)
+            if args.visualize:
+                o3d.visualization.draw_geometries([combined_mesh_roi])
+            fscore = compute_f_score(
+                ground_truth_mesh_scan, combined_mesh_roi, visualize=args.visualize
+            )
             print(f"Combined F-score for all experiments {tumor}: {fscore}")
     else:
         for tumor in TUMOR_ID.keys():
@@ -3,7 +3,6 @@ from collections import deque
 import click
 from pathlib import Path
 import multiprocessing as mp
-from multiprocessing import shared_memory
 
 import numpy as np
 import open3d as o3d
@@ -11,9 +10,10 @@ import pinocchio as pin
 from scipy.spatial.transform import Rotation
 
 from deoxys.franka_interface import FrankaInterface
-from deoxys.utils.transform_utils import quat2axisangle, quat2mat
+from deoxys.utils.transform_utils import quat2mat
 from deoxys.utils import YamlConfig
-from rpal.algorithms.grid import SurfaceGridMap
+from rpal.algorithms.background_search import BackgroundSearch
+from rpal.algorithms.grid import cached_surface_grid_map
 from rpal.algorithms.search import (
     RandomSearch,
     SearchHistory,
@@ -24,19 +24,50 @@ from rpal.algorithms.search import (
 from rpal.utils.control_utils import generate_joint_space_min_jerk
 from rpal.utils.data_utils import DatasetWriter
 from rpal.utils.devices import ForceSensor
+from rpal.utils.sim_devices import (
+    PhantomForceSensor,
+    PhantomModel,
+    SimClock,
+    SimFrankaInterface,
+)
 from rpal.utils.interpolator import Interpolator, InterpType
-from rpal.utils.time_utils import Ratekeeper
-from rpal.utils.proc_utils import RingBuffer, RunningStats
+from rpal.utils.time_utils import Ratekeeper, StageProfiler
+from rpal.utils.proc_utils import (
+    RingBuffer,
+    RunningStats,
+    SharedRingBuffer,
+    wait_until,
+)
 import rpal.utils.constants as rpal_const
 from rpal.utils.constants import PALP_CONST
 from rpal.utils.constants import PalpateState
-from rpal.utils.pcd_utils import scan2mesh, mesh2roi
 from tfvis.visualizer import RealtimeVisualizer
 
+# main_ctrl tick stages, in loop order
+CTRL_STAGES = ("state_update", "force_read", "planner", "interp", "control", "shm_write")
 
-def main_ctrl(shm_buffer, stop_event: mp.Event, save_folder: Path, search: Search):
-    existing_shm = shared_memory.SharedMemory(name=shm_buffer)
-    data_buffer = np.ndarray(1, dtype=rpal_const.PALP_DTYPE, buffer=existing_shm.buf)
+
+def main_ctrl(
+    shm_buffer,
+    stop_event: mp.Event,
+    save_folder: Path,
+    search: Search,
+    phantom: PhantomModel = None,
+    sim_speedup=None,
+    shm_profiler=None,
+):
+    """
+    Palpation control loop. With a phantom the robot and force sensor are simulated
+    on a SimClock running at sim_speedup x real time (None: as fast as possible).
+    Stage durations of every tick go to the StageProfiler named shm_profiler.
+    """
+    data_buffer = SharedRingBuffer.attach(
+        shm_buffer, rpal_const.PALP_DTYPE, PALP_CONST.ring_buffer_size
+    )
+    if shm_profiler is None:
+        profiler = StageProfiler(CTRL_STAGES, shared=False)
+    else:
+        profiler = StageProfiler.attach(shm_profiler, CTRL_STAGES)
     np.random.seed(PALP_CONST.seed)
     goals = deque([])
     force_buffer = RingBuffer(PALP_CONST.buffer_size)
@@ -55,7 +86,11 @@ def main_ctrl(shm_buffer, stop_event: mp.Event, save_folder: Path, search: Searc
     palp_progress = 0.0  # [0, 1]
     palp_id = 0
     stiffness = 0.0
-    search_history = SearchHistory()
+    search_history = SearchHistory(
+        save_folder,
+        delta=PALP_CONST.history_delta,
+        keyframe_interval=PALP_CONST.history_keyframe_interval,
+    )
     CF_start_time = None
     oscill_start_time = None
     start_angles = np.full(2, -PALP_CONST.angle_oscill)  # theta, phi
@@ -74,12 +109,18 @@ def main_ctrl(shm_buffer, stop_event: mp.Event, save_folder: Path, search: Searc
         1 / PALP_CONST.ctrl_freq,
     )
     force_oscill_traj = force_oscill_out + force_oscill_in
-    force_cap = ForceSensor()
-    robot_interface = FrankaInterface(
-        str(rpal_const.PAN_PAN_FORCE_CFG),
-        use_visualizer=False,
-        control_freq=80,
-    )
+    if phantom is None:
+        clock = time
+        force_cap = ForceSensor()
+        robot_interface = FrankaInterface(
+            str(rpal_const.PAN_PAN_FORCE_CFG),
+            use_visualizer=False,
+            control_freq=80,
+        )
+    else:
+        clock = SimClock(sim_speedup)
+        robot_interface = SimFrankaInterface(phantom, clock)
+        force_cap = PhantomForceSensor(robot_interface, seed=PALP_CONST.seed)
     force_ctrl_cfg = YamlConfig(str(rpal_const.FORCE_CTRL_CFG)).as_easydict()
     osc_abs_ctrl_cfg = YamlConfig(str(rpal_const.OSC_ABSOLUTE_CFG)).as_easydict()
     robot_interface._state_buffer = []
@@ -120,8 +161,12 @@ def main_ctrl(shm_buffer, stop_event: mp.Event, save_folder: Path, search: Searc
         pose_goal = goals.pop()
         interp.init(curr_pose_se3, pose_goal, steps=steps)
 
-    while len(robot_interface._state_buffer) == 0:
-        continue
+    wait_until(
+        lambda: len(robot_interface._state_buffer) > 0,
+        timeout=rpal_const.STARTUP_TIMEOUT,
+        stop_event=stop_event,
+        name="robot state",
+    )
 
     start_pose = pin.SE3.Identity()
     start_pose.translation = rpal_const.GT_SCAN_POSE[:3]
@@ -133,11 +178,15 @@ def main_ctrl(shm_buffer, stop_event: mp.Event, save_folder: Path, search: Searc
     curr_pose_se3.translation = curr_eef_pose[1]
     pose_goal = goals.pop()
     interp.init(curr_pose_se3, pose_goal, steps=rpal_const.STEP_FAST)
+    # the robot interface paces the loop, this only records its timing
+    ctrl_rk = Ratekeeper(PALP_CONST.ctrl_freq, print_delay_threshold=None, name="ctrl")
     try:
         while not stop_event.is_set():
+            profiler.tick()
             curr_eef_pose = robot_interface.last_eef_rot_and_pos
             curr_pose_se3.rotation = curr_eef_pose[0]
             curr_pose_se3.translation = curr_eef_pose[1]
+            profiler.mark("state_update")
 
             Fxyz_temp = force_cap.read()
             if Fxyz_temp is not None:
@@ -150,13 +199,14 @@ def main_ctrl(shm_buffer, stop_event: mp.Event, save_folder: Path, search: Searc
 
             if force_buffer.overflowed():
                 running_stats.update(force_buffer.buffer)
+            profiler.mark("force_read")
 
             # terminate palpation and reset goals
 
             # done with palpation
             if (
                 using_force_control_flag
-                and (palp_progress >= 1 or time.time() - CF_start_time > max_cf_time)
+                and (palp_progress >= 1 or clock.time() - CF_start_time > max_cf_time)
                 # and pos_buffer.std < PALP_CONST.pos_stable_thres
             ):
                 print("palpation done")
@@ -197,7 +247,7 @@ def main_ctrl(shm_buffer, stop_event: mp.Event, save_folder: Path, search: Searc
                 if (
                     Fxyz[2] >= PALP_CONST.max_Fz or palp_progress >= 1.0
                 ) and not using_force_control_flag:
-                    CF_start_time = time.time()
+                    CF_start_time = clock.time()
                     print("CONTOUR FOLLOWING!")
                     stiffness = Fxyz[2] / (
                         np.linalg.norm(curr_pose_se3.translation - palp_pt) + 1e-6
@@ -205,22 +255,21 @@ def main_ctrl(shm_buffer, stop_event: mp.Event, save_folder: Path, search: Searc
                     stiffness /= PALP_CONST.stiffness_normalization
                     using_force_control_flag = True
                     collect_points_flag = True
-                    oscill_start_time = time.time()
+                    oscill_start_time = clock.time()
                     print("STIFFNESS: ", stiffness)
                     search.update_outcome(stiffness)
+            profiler.mark("planner")
 
             # control: force
             if using_force_control_flag:
-                if time.time() - oscill_start_time > PALP_CONST.t_oscill:
-                    oscill_start_time = time.time()
-                idx = int(
-                    (time.time() - oscill_start_time) / (1 / PALP_CONST.ctrl_freq)
-                )
                 action = np.zeros(9)
-                oscill_pos = force_oscill_traj[idx]["position"]
+                oscill_pos = force_oscill_traj.at(
+                    clock.time() - oscill_start_time, wrap=True
+                )
                 action[0] = oscill_pos[0]
                 action[1] = oscill_pos[1]
                 action[2] = -0.005
+                profiler.mark("interp")
                 robot_interface.control(
                     controller_type=rpal_const.FORCE_CTRL_TYPE,
                     action=action,
@@ -230,49 +279,55 @@ def main_ctrl(shm_buffer, stop_event: mp.Event, save_folder: Path, search: Searc
             # control: OSC
             else:
                 action = np.zeros(7)
-                next_se3_pose = interp.next()
-                target_xyz_quat = pin.SE3ToXYZQUAT(next_se3_pose)
-                axis_angle = quat2axisangle(target_xyz_quat[3:7])
-
-                # print(se3_pose)
-                action[:3] = target_xyz_quat[:3]
-                action[3:6] = axis_angle
+                action[:6] = interp.next()
+                target_xyz_quat = interp.xyz_quat
                 # print(action)
+                profiler.mark("interp")
 
                 robot_interface.control(
                     controller_type=rpal_const.OSC_CTRL_TYPE,
                     action=action,
                     controller_cfg=osc_abs_ctrl_cfg,
                 )
+            profiler.mark("control")
             q, p = robot_interface.last_eef_quat_and_pos
             save_action = np.zeros(9)
             save_action[: len(action)] = action
-            data_buffer[0] = (
-                Fxyz,
-                q.flatten(),  # quat
-                p.flatten(),  # pos
-                target_xyz_quat[3:7],
-                target_xyz_quat[:3],
-                save_action,
-                palp_progress,
-                palp_pt if palp_pt is not None else np.zeros(3),
-                surf_normal if surf_normal is not None else np.zeros(3),
-                palp_id,
-                palp_state.state,
-                stiffness,
-                using_force_control_flag,
-                collect_points_flag,
+            data_buffer.push(
+                (
+                    Fxyz,
+                    q.flatten(),  # quat
+                    p.flatten(),  # pos
+                    target_xyz_quat[3:7],
+                    target_xyz_quat[:3],
+                    save_action,
+                    palp_progress,
+                    palp_pt if palp_pt is not None else np.zeros(3),
+                    surf_normal if surf_normal is not None else np.zeros(3),
+                    palp_id,
+                    palp_state.state,
+                    stiffness,
+                    using_force_control_flag,
+                    collect_points_flag,
+                )
             )
+            profiler.mark("shm_write")
+            ctrl_rk.monitor_time()
 
     except KeyboardInterrupt:
         pass
 
     # stop
     robot_interface.close()
-    search_history.save(save_folder)
+    force_cap.close()
+    search_history.save()
     print("history saved")
+    ctrl_rk.save(save_folder / "ctrl_timing")
+    print(f"ctrl loop: {ctrl_rk.overruns} overruns in {ctrl_rk.frame} ticks")
     stop_event.set()
-    existing_shm.close()
+    print(f"dropped {data_buffer.dropped} samples")
+    data_buffer.close()
+    profiler.close()
 
 
 @click.command()
@@ -294,11 +349,36 @@ def main_ctrl(shm_buffer, stop_event: mp.Event, save_folder: Path, search: Searc
 @click.option(
     "--discrete_only", "-s", type=bool, help="discrete probing only", default=False
 )
+@click.option(
+    "--background_planner",
+    "-p",
+    type=bool,
+    help="plan next palpation in a separate process",
+    default=True,
+)
+@click.option(
+    "--sim", type=bool, help="simulated robot and phantom, no hardware", default=False
+)
+@click.option(
+    "--sim_speedup",
+    type=float,
+    help="simulated time per wall second, 0 runs as fast as possible",
+    default=0.0,
+)
 def main(
-    tumor, algo, select_bbox, max_palpations, autosave, seed, debug, discrete_only
+    tumor,
+    algo,
+    select_bbox,
+    max_palpations,
+    autosave,
+    seed,
+    debug,
+    discrete_only,
+    background_planner,
+    sim,
+    sim_speedup,
 ):
     pcd = o3d.io.read_point_cloud(str(rpal_const.SURFACE_SCAN_PATH))
-    surface_mesh = scan2mesh(pcd)
     PALP_CONST.max_palpations = max_palpations
     PALP_CONST.algo = algo
     PALP_CONST.seed = np.random.randint(1000) if seed is None else seed
@@ -313,11 +393,10 @@ def main(
     if select_bbox:
         bbox_roi = None
 
-    roi_pcd = mesh2roi(surface_mesh, bbox_pts=bbox_roi)
-    print("here")
-    surface_grid_map = SurfaceGridMap(
-        roi_pcd, grid_size=rpal_const.PALP_CONST.grid_size
+    surface_grid_map = cached_surface_grid_map(
+        pcd, bbox_roi, grid_size=rpal_const.PALP_CONST.grid_size
     )
+    roi_pcd = surface_grid_map.pcd
     if debug:
         surface_grid_map.visualize()
 
@@ -330,20 +409,40 @@ def main(
         )
     elif algo == "random":
         search = RandomSearch(surface_grid_map)
+    if background_planner:
+        search = BackgroundSearch(search, seed=PALP_CONST.seed)
     # search.grid.visualize()
-    dataset_writer = DatasetWriter(prefix=f"{tumor}_{algo}", print_hz=False)
-    data_buffer = np.zeros(1, dtype=rpal_const.PALP_DTYPE)
-    shm = shared_memory.SharedMemory(create=True, size=data_buffer.nbytes)
-    data_buffer = np.ndarray(data_buffer.shape, dtype=data_buffer.dtype, buffer=shm.buf)
+    dataset_writer = DatasetWriter(
+        prefix=f"{tumor}_{algo}", print_hz=False, stream=True
+    )
+    data_buffer = SharedRingBuffer(
+        rpal_const.PALP_DTYPE, capacity=PALP_CONST.ring_buffer_size
+    )
+    phantom = None
+    if sim:
+        phantom = PhantomModel.from_grid(
+            surface_grid_map, rpal_const.RPAL_MESH_PATH / f"tumor_{tumor}.stl"
+        )
+    profiler = StageProfiler(CTRL_STAGES)
     stop_event = mp.Event()
     ctrl_process = mp.Process(
         target=main_ctrl,
-        args=(shm.name, stop_event, dataset_writer.dataset_folder, search),
+        args=(data_buffer.name, stop_event, dataset_writer.dataset_folder, search),
+        kwargs=dict(
+            phantom=phantom,
+            sim_speedup=sim_speedup or None,
+            shm_profiler=profiler.name,
+        ),
     )
     ctrl_process.start()
 
     subsurface_pts = []
 
+    def log_samples(samples):
+        dataset_writer.add_samples(samples)
+        collect_pts = samples["collect_points_flag"] == 1
+        subsurface_pts.extend(samples["O_p_EE"][collect_pts])
+
     rk = Ratekeeper(50, name="data_collect")
 
     rtv = RealtimeVisualizer()
@@ -352,22 +451,27 @@ def main(
     rtv.add_frame("EEF", "BASE")
     try:
         while not stop_event.is_set():
-            if np.all(data_buffer["O_q_EE"] == 0):
+            try:
+                if not data_buffer.wait(timeout=1.0, stop_event=stop_event):
+                    break
+            except TimeoutError:
                 # print("Waiting for deoxys...")
+                if not ctrl_process.is_alive():
+                    break
                 continue
+            samples = data_buffer.drain()
+            log_samples(samples)
+            latest = samples[-1]
 
-            O_p_EE = data_buffer["O_p_EE"].flatten()
-            O_p_EE_target = data_buffer["O_p_EE_target"].flatten()
-            O_q_EE_target = data_buffer["O_q_EE_target"].flatten()
-            O_q_EE = data_buffer["O_q_EE"].flatten()
-            if data_buffer["collect_points_flag"]:
-                subsurface_pts.append(O_p_EE)
+            O_p_EE = latest["O_p_EE"].flatten()
+            O_p_EE_target = latest["O_p_EE_target"].flatten()
+            O_q_EE_target = latest["O_q_EE_target"].flatten()
+            O_q_EE = latest["O_q_EE"].flatten()
 
-            print(data_buffer)
+            print(latest)
             # print("Pos ERROR: ", np.linalg.norm(O_p_EE - O_p_EE_target))
             # print("Rot ERROR: ", np.linalg.norm(O_q_EE - O_q_EE_target))
 
-            dataset_writer.add_sample(data_buffer.copy())
             ee_pos = np.array(O_p_EE)
             ee_rmat = quat2mat(O_q_EE)
             O_T_E = np.eye(4)
@@ -380,16 +484,21 @@ def main(
     stop_event.set()
     print("CTRL STOPPED!")
 
-    while ctrl_process.is_alive():
-        continue
     ctrl_process.join()
+    if background_planner:
+        search.close()
+    log_samples(data_buffer.drain())
 
     dataset_writer.save_subsurface_pcd(np.array(subsurface_pts).squeeze())
     dataset_writer.save_roi_pcd(roi_pcd)
     dataset_writer.save_grid_pcd(surface_grid_map.grid_pcd)
+    profiler.save(dataset_writer.dataset_folder / "ctrl_stage_latency")
+    rk.save(dataset_writer.dataset_folder / "data_collect_timing")
+    for stage, stats in profiler.summary().items():
+        print(f"{stage:>12}: {stats}")
     dataset_writer.save(autosave)
-    shm.close()
-    shm.unlink()
+    data_buffer.close()
+    profiler.close()
 
 
 if __name__ == "__main__":
@@ -1,7 +1,6 @@
 import argparse
 import multiprocessing as mp
 from datetime import datetime
-from multiprocessing import shared_memory
 import numpy as np
 import open3d as o3d
 import pinocchio as pin
@@ -10,9 +9,10 @@ from tfvis.visualizer import RealtimeVisualizer
 
 from deoxys.franka_interface import FrankaInterface
 from deoxys.utils import YamlConfig
-from deoxys.utils.transform_utils import quat2mat, quat2axisangle
+from deoxys.utils.transform_utils import quat2mat
 from rpal.utils.devices import RealsenseCapture
-from rpal.utils.pcd_utils import pick_surface_bbox
+from rpal.utils.pcd_utils import VoxelAccumulator, pick_surface_bbox, volume_mask
+from rpal.utils.proc_utils import SharedArray, wait_until
 from rpal.utils.time_utils import Ratekeeper
 from rpal.utils.transform_utils import euler2mat
 from rpal.utils.interpolator import Interpolator, InterpType
@@ -20,8 +20,7 @@ import rpal.utils.constants as rpal_const
 
 
 def deoxys_ctrl(shm_posearr_name, stop_event):
-    existing_shm = shared_memory.SharedMemory(name=shm_posearr_name)
-    O_T_EE_posquat = np.ndarray(7, dtype=np.float32, buffer=existing_shm.buf)
+    O_T_EE_shared = SharedArray.attach(shm_posearr_name, 7, dtype=np.float32)
     robot_interface = FrankaInterface(
         str(rpal_const.PAN_PAN_FORCE_CFG), use_visualizer=False, control_freq=80
     )
@@ -46,13 +45,15 @@ def deoxys_ctrl(shm_posearr_name, stop_event):
         Ry[:3, :3] = euler2mat(np.array([0, ang, 0]))
         goals.append(O_T_P @ Ry @ P_T_E)
 
-    while len(robot_interface._state_buffer) == 0:
-        continue
+    wait_until(
+        lambda: len(robot_interface._state_buffer) > 0,
+        timeout=rpal_const.STARTUP_TIMEOUT,
+        name="robot state",
+    )
 
     while len(goals) != 0 or not interp.done:
         q, p = robot_interface.last_eef_quat_and_pos
-        O_T_EE_posquat[:3] = p.flatten()
-        O_T_EE_posquat[3:7] = q.flatten()
+        O_T_EE_shared.write(np.concatenate([p.flatten(), q.flatten()]))
 
         curr_eef_pose = robot_interface.last_eef_rot_and_pos
         curr_pose_se3 = pin.SE3.Identity()
@@ -69,12 +70,7 @@ def deoxys_ctrl(shm_posearr_name, stop_event):
             )
 
         action = np.zeros(7)
-        next_se3_pose = interp.next()
-        xyz_quat = pin.SE3ToXYZQUAT(next_se3_pose)
-        axis_angle = quat2axisangle(xyz_quat[3:7])
-
-        action[:3] = xyz_quat[:3]
-        action[3:6] = axis_angle
+        action[:6] = interp.next()
 
         robot_interface.control(
             controller_type=rpal_const.OSC_CTRL_TYPE,
@@ -86,8 +82,7 @@ def deoxys_ctrl(shm_posearr_name, stop_event):
     stop_event.set()
     robot_interface.close()
 
-    existing_shm.close()
-    existing_shm.unlink()
+    O_T_EE_shared.close()
 
 
 if __name__ == "__main__":
@@ -97,19 +92,20 @@ if __name__ == "__main__":
         "--calibration-cfg", type=str, default="camera_calibration_12-16-2023_14-48-12"
     )
     argparser.add_argument("--cam-name", type=str, default="wrist_d415")
+    argparser.add_argument("--voxel-size", type=float, default=0.0005)
+    argparser.add_argument(
+        "--depth-weighted",
+        action="store_true",
+        help="weight points by 1/depth^2 to favour close range measurements",
+    )
     args = argparser.parse_args()
 
-    O_T_EE_posquat = np.zeros(7, dtype=np.float32)
-    shm = shared_memory.SharedMemory(create=True, size=O_T_EE_posquat.nbytes)
-    O_T_EE_posquat = np.ndarray(
-        O_T_EE_posquat.shape, dtype=O_T_EE_posquat.dtype, buffer=shm.buf
-    )
+    O_T_EE_shared = SharedArray(7, dtype=np.float32)
     stop_event = mp.Event()
-    ctrl_process = mp.Process(target=deoxys_ctrl, args=(shm.name, stop_event))
+    ctrl_process = mp.Process(target=deoxys_ctrl, args=(O_T_EE_shared.name, stop_event))
     ctrl_process.start()
 
-    while np.all(O_T_EE_posquat == 0):
-        continue
+    O_T_EE_shared.wait(timeout=rpal_const.STARTUP_TIMEOUT)
 
     # print(np_to_constant("GT_SCAN_POSE", O_T_EE_posquat))
 
@@ -124,8 +120,8 @@ if __name__ == "__main__":
         E_T_C[:3, :3] = ee_rot
         E_T_C[:3, 3] = ee_pos
 
-    rs = RealsenseCapture()
-    pcd = o3d.geometry.PointCloud()
+    rs = RealsenseCapture(threaded=True)
+    voxels = VoxelAccumulator(voxel_size=args.voxel_size)
 
     rk = Ratekeeper(1)
 
@@ -140,28 +136,36 @@ if __name__ == "__main__":
     rtv.add_frame("CAM", "EEF")
     rtv.add_frame("TUMOR", "BASE")
 
-    selected_bbox = rpal_const.BBOX_PHANTOM
+    bbox = pick_surface_bbox(None, bbox_pts=rpal_const.BBOX_PHANTOM)
+    frame_id = -1
 
     while not stop_event.is_set():
-        # _, new_pcd = rs.read(get_mask=lambda x: get_color_mask(x, TUMOR_HSV_THRESHOLD))
-        _, new_pcd = rs.read()
+        frame = rs.latest(after_id=frame_id, timeout=1.0)
+        if frame is None:
+            continue
+        frame_id = frame.frame_id
+        _, new_pcd = frame.data
 
+        O_T_EE_posquat = O_T_EE_shared.read()
         ee_pos = np.array(O_T_EE_posquat[:3])
         ee_mat = quat2mat(O_T_EE_posquat[3:7])
         O_T_E = np.eye(4)
         O_T_E[:3, :3] = ee_mat
         O_T_E[:3, 3] = ee_pos
         O_T_C = O_T_E @ E_T_C
-        new_pcd.transform(O_T_C)
-        bbox = pick_surface_bbox(new_pcd, bbox_pts=selected_bbox)
-        # print(array2constant("BBOX_ROI", np.asarray(bbox.get_box_points())))
-        selected_bbox = np.asarray(bbox.get_box_points())
-        new_pcd = new_pcd.crop(bbox)
-        pcd += new_pcd
-        tumor_pts = np.asarray(pcd.points)
-        tumor_mean = tumor_pts.mean(axis=0)
+        C_pts = new_pcd.point.positions.numpy().astype(np.float64)
+        O_pts = C_pts @ O_T_C[:3, :3].T + O_T_C[:3, 3]
+        in_bbox = volume_mask(bbox, O_pts)
+        weights = None
+        if args.depth_weighted:
+            weights = 1 / np.maximum(C_pts[in_bbox, 2], 1e-3) ** 2
+        voxels.integrate(
+            O_pts[in_bbox],
+            new_pcd.point.colors.numpy()[in_bbox],
+            weights,
+        )
         O_T_TUM = np.eye(4)
-        O_T_TUM[:3, 3] = tumor_mean
+        O_T_TUM[:3, 3] = voxels.centroid
 
         # tf visualizer
         rtv.set_frame_tf("EEF", O_T_E)
@@ -170,6 +174,7 @@ if __name__ == "__main__":
 
         rk.keep_time()
 
+    rs.stop()
     ctrl_process.join()
     print("CTRL STOPPED!")
 
@@ -178,6 +183,6 @@ if __name__ == "__main__":
 
     print(f"saving to {save_pth}")
 
-    o3d.io.write_point_cloud(save_pth, pcd)
+    o3d.io.write_point_cloud(save_pth, voxels.to_pcd())
 
-    shm.close()
+    O_T_EE_shared.close()
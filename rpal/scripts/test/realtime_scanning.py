@@ -5,7 +5,6 @@ import os
 import subprocess
 import sys
 from io import StringIO
-from multiprocessing import shared_memory
 from pathlib import Path
 
 import cv2
@@ -27,13 +26,13 @@ from deoxys.utils.transform_utils import mat2euler, mat2quat, quat2mat
 from rpal.utils.constants import *
 from rpal.utils.data_utils import Hz
 from rpal.utils.devices import RealsenseCapture
+from rpal.utils.proc_utils import SharedArray, wait_until
 from rpal.utils.time_utils import Ratekeeper
 from rpal.utils.transform_utils import euler2mat
 
 
 def deoxys_ctrl(shm_posearr_name, stop_event):
-    existing_shm = shared_memory.SharedMemory(name=shm_posearr_name)
-    O_T_EE_shm = np.ndarray(7, dtype=np.float32, buffer=existing_shm.buf)
+    O_T_EE_shared = SharedArray.attach(shm_posearr_name, 7, dtype=np.float32)
     print(args.interface_cfg)
     robot_interface = FrankaInterface(
         str(RPAL_CFG_PATH / PAN_PAN_FORCE_CFG), use_visualizer=False, control_freq=20
@@ -43,13 +42,15 @@ def deoxys_ctrl(shm_posearr_name, stop_event):
     device = SpaceMouse(vendor_id=SPACEM_VENDOR_ID, product_id=SPACEM_PRODUCT_ID)
     device.start_control()
 
-    while len(robot_interface._state_buffer) == 0:
-        continue
+    wait_until(
+        lambda: len(robot_interface._state_buffer) > 0,
+        timeout=STARTUP_TIMEOUT,
+        name="robot state",
+    )
 
     while not stop_event.is_set():
         q, p = robot_interface.last_eef_quat_and_pos
-        O_T_EE[:3] = p.flatten()
-        O_T_EE[3:7] = q.flatten()
+        O_T_EE_shared.write(np.concatenate([p.flatten(), q.flatten()]))
 
         action, grasp = input2action(
             device=device,
@@ -70,8 +71,7 @@ def deoxys_ctrl(shm_posearr_name, stop_event):
     )
     robot_interface.close()
 
-    existing_shm.close()
-    existing_shm.unlink()
+    O_T_EE_shared.close()
 
 
 if __name__ == "__main__":
@@ -83,14 +83,12 @@ if __name__ == "__main__":
     argparser.add_argument("--cam-name", type=str, default="wrist_d415")
     args = argparser.parse_args()
 
-    O_T_EE = np.zeros(7, dtype=np.float32)
-    shm = shared_memory.SharedMemory(create=True, size=O_T_EE.nbytes)
-    O_T_EE = np.ndarray(O_T_EE.shape, dtype=O_T_EE.dtype, buffer=shm.buf)
+    O_T_EE_shared = SharedArray(7, dtype=np.float32)
     stop_event = mp.Event()
-    ctrl_process = mp.Process(target=deoxys_ctrl, args=(shm.name, stop_event))
+    ctrl_process = mp.Process(target=deoxys_ctrl, args=(O_T_EE_shared.name, stop_event))
     ctrl_process.start()
 
-    rs = RealsenseCapture()
+    rs = RealsenseCapture(threaded=True)
     with open(
         str(RPAL_CFG_PATH / args.calibration_cfg / "extrinsics.yaml"), "r"
     ) as file:
@@ -103,8 +101,10 @@ if __name__ == "__main__":
         E_T_C[:3, :3] = ee_rot
         E_T_C[:3, 3] = ee_pos
 
-    im, pcd = rs.read()
+    frame = rs.latest()
 
+    print("Waiting for pose...")
+    O_T_EE_shared.wait(timeout=STARTUP_TIMEOUT)
     rk = Ratekeeper(30)
 
     rtv = RealtimeVisualizer()
@@ -119,10 +119,8 @@ if __name__ == "__main__":
     rtv.add_frame("PHANTOM", "BASE")
     try:
         while 1:
-            if np.all(O_T_EE == 0):
-                print("Waiting for pose...")
-                continue
-            # im, new_pcd = rs.read()
+            O_T_EE = O_T_EE_shared.read()
+            # frame = rs.latest(after_id=frame.frame_id, timeout=0)
             ee_pos = np.array(O_T_EE[:3])
             ee_rot = quat2mat(O_T_EE[3:7])
             O_T_E = np.eye(4)
@@ -135,9 +133,9 @@ if __name__ == "__main__":
     except KeyboardInterrupt:
         pass
     stop_event.set()
+    rs.stop()
     ctrl_process.join()
     print("CTRL STOPPED!")
 
-    shm.close()
-    shm.unlink()
+    O_T_EE_shared.close()
     vis.destroy_window()
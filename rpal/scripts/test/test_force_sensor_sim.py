@@ -0,0 +1,31 @@
+import argparse
+import time
+
+import numpy as np
+
+from rpal.utils.devices import ForceSensor, SimulatedForceSensor
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(
+        description="Runs ForceSensor against a simulated sensor on a pty"
+    )
+    argparser.add_argument("--protocol", type=str, default="binary")
+    argparser.add_argument("--rate", type=int, default=1000)
+    argparser.add_argument("--duration", type=float, default=2.0)
+    args = argparser.parse_args()
+
+    sim = SimulatedForceSensor(protocol=args.protocol, rate=args.rate)
+    fs = ForceSensor(port=sim.port, protocol=args.protocol)
+    assert fs.wait_for_sample(timeout=2.0), "no samples from simulated sensor"
+
+    start = time.monotonic()
+    time.sleep(args.duration)
+    samples = fs.since(start)
+    latest = fs.latest()
+    fs.close()
+    sim.close()
+
+    dt = np.diff(samples["device_t"])
+    print(f"received {len(samples)} samples in {args.duration}s, {fs.bad_frames} bad frames")
+    print(f"device period {dt.mean() * 1e3:.3f} ms, max gap {dt.max() * 1e3:.3f} ms")
+    print(f"latest {latest['Fxyz']} received {time.monotonic() - latest['t']:.3f}s ago")
@@ -43,11 +43,7 @@ if __name__ == "__main__":
 
     try:
         while True:
-            if time.time() - start_time > total_time:
-                start_time = time.time()
-
-            force_idx = int((time.time() - start_time) / (1 / PALP_CONST.ctrl_freq))
-            pos_t = force_osc[force_idx]["position"]
+            pos_t = force_osc.at(time.time() - start_time, wrap=True)
             # action[-3:] = mag * wrench
             # action[-3:] = z_unit
             action[0] = pos_t[0]
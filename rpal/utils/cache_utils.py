@@ -0,0 +1,47 @@
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+
+def hash_arrays(*arrays, **params) -> str:
+    """Content hash of numpy arrays and keyword parameters, used as a cache key"""
+    h = hashlib.sha1()
+    for arr in arrays:
+        arr = np.ascontiguousarray(arr)
+        h.update(f"{arr.dtype}{arr.shape}".encode())
+        h.update(arr.tobytes())
+    for key in sorted(params):
+        h.update(f"{key}={params[key]!r}".encode())
+    return h.hexdigest()
+
+
+def hash_file(path: Path, chunk_size=2**20) -> str:
+    h = hashlib.sha1()
+    with open(str(path), "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def cache_file(cache_dir: Path, name: str, key: str, suffix=".npz") -> Path:
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    return cache_dir / f"{name}_{key}{suffix}"
+
+
+def save_npz(path: Path, **arrays):
+    """
+    np.savez through a temporary file in the same directory, moved onto path once
+    complete, so an interrupted write never leaves a truncated cache entry behind
+    """
+    path = Path(path)
+    fd, tmp_path = tempfile.mkstemp(dir=str(path.parent), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, str(path))
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
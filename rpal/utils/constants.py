@@ -17,12 +17,18 @@ RPAL_CFG_PATH = Path(rpal.__file__).parent.absolute() / "config"
 RPAL_MESH_PATH = Path(rpal.__file__).parent.absolute() / "meshes"
 RPAL_DATA_PATH = Path(rpal.__file__).parent.absolute() / "data"
 RPAL_CKPT_PATH = Path(rpal.__file__).parent.absolute() / ".ckpts"
+GRID_CACHE_PATH = RPAL_CKPT_PATH / "grid_cache"
+GT_CACHE_PATH = RPAL_CKPT_PATH / "gt_cache"
 
 # camera calibration
 
 CAMERA_CALIB_FOLDER = RPAL_CFG_PATH / "camera_calibration_12-16-2023_14-48-12"
 
 
+# process sync
+STARTUP_TIMEOUT = 30.0  # s, waiting on the first robot state or pose
+PLANNER_TIMEOUT = 30.0  # s, waiting on the background planner for a target
+
 # deoxys controllers
 OSC_CTRL_TYPE = "OSC_POSE"
 FORCE_CTRL_TYPE = "RPAL_HYBRID_POSITION_FORCE"
@@ -109,6 +115,30 @@ def HISTORY_DTYPE(grid_size):
     )
 
 
+HISTORY_INDEX_DTYPE = np.dtype(
+    [
+        ("sample_pt", np.dtype((np.int32, 2))),
+        ("keyframe", np.int64),
+        ("delta_start", np.int64),
+        ("delta_end", np.int64),
+    ]
+)
+
+HISTORY_DELTA_DTYPE = np.dtype([("cell", np.int32), ("value", np.float32)])
+
+
+def PLAN_DTYPE(grid_size):
+    """next palpation target and grid estimate handed back by a planner process"""
+    return np.dtype(
+        [
+            ("palp_pt", np.dtype((np.float64, 3))),
+            ("surf_normal", np.dtype((np.float64, 3))),
+            ("sample_pt", np.dtype((np.int32, 2))),
+            ("grid", np.dtype((np.float32, grid_size))),
+        ]
+    )
+
+
 # palpation
 PALP_DTYPE = np.dtype(
     [
@@ -154,6 +184,9 @@ class PALP_CONST:
     max_Fz = 5.0
     buffer_size = 100
     dataset_buffer_size = 100
+    ring_buffer_size = 1024  # ctrl -> logger samples, ~12 s at ctrl_freq
+    history_delta = False  # store only changed grid cells between keyframes
+    history_keyframe_interval = 20  # palpations
     force_stable_thres = 0.05  # N
     pos_stable_thres = 1e-4  # m
     above_height = 0.01
@@ -25,8 +25,110 @@ def _min_jerk_spaces(N: int, T: float):
 
     return p_traj, pd_traj, pdd_traj
 
-def generate_joint_space_min_jerk(
-    start, goal, time_to_go: float, dt: float):
+
+class MinJerkTrajectory:
+    """
+    Trajectory sampled every dt seconds, stored as contiguous time (N,) and
+    position/velocity/acceleration (N, dof) arrays. Indexing returns the waypoint
+    dict of the old list-of-waypoints format, at(t) interpolates between samples
+    in O(1) and + concatenates into a TrajectorySequence without copying.
+    """
+
+    KEYS = ("position", "velocity", "acceleration")
+
+    def __init__(self, position, velocity, acceleration, dt):
+        self.position = position
+        self.velocity = velocity
+        self.acceleration = acceleration
+        self.dt = dt
+        self.time_from_start = np.arange(len(position)) * dt
+
+    @classmethod
+    def generate(cls, start, goal, time_to_go: float, dt: float):
+        return generate_joint_space_min_jerk(start, goal, time_to_go, dt)
+
+    def __len__(self):
+        return len(self.position)
+
+    @property
+    def duration(self):
+        return len(self) * self.dt
+
+    def __getitem__(self, i):
+        return {
+            "time_from_start": self.time_from_start[i],
+            "position": self.position[i],
+            "velocity": self.velocity[i],
+            "acceleration": self.acceleration[i],
+        }
+
+    def __add__(self, other):
+        return TrajectorySequence([self]) + other
+
+    def _interp(self, arr, t):
+        s = np.clip(t / self.dt, 0, len(self) - 1)
+        i = min(int(s), len(self) - 2) if len(self) > 1 else 0
+        frac = s - i
+        if frac == 0:
+            return arr[i]
+        return arr[i] + frac * (arr[i + 1] - arr[i])
+
+    def at(self, t, wrap=False):
+        """position at t seconds from start, clamped to the ends or wrapped"""
+        if wrap:
+            t = t % self.duration
+        return self._interp(self.position, t)
+
+    def state_at(self, t, wrap=False):
+        if wrap:
+            t = t % self.duration
+        return {k: self._interp(getattr(self, k), t) for k in self.KEYS}
+
+
+class TrajectorySequence:
+    """Trajectories played back to back, referenced rather than copied"""
+
+    def __init__(self, segments):
+        self.segments = list(segments)
+        self._start_idx = np.cumsum([0] + [len(s) for s in self.segments])
+        self._start_t = np.cumsum([0.0] + [s.duration for s in self.segments])
+
+    def __len__(self):
+        return int(self._start_idx[-1])
+
+    @property
+    def duration(self):
+        return self._start_t[-1]
+
+    def __add__(self, other):
+        others = other.segments if isinstance(other, TrajectorySequence) else [other]
+        return TrajectorySequence(self.segments + others)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        seg = np.searchsorted(self._start_idx, i, side="right") - 1
+        return self.segments[seg][i - self._start_idx[seg]]
+
+    def _segment(self, t, wrap):
+        if wrap:
+            t = t % self.duration
+        seg = np.searchsorted(self._start_t, t, side="right") - 1
+        seg = min(max(seg, 0), len(self.segments) - 1)
+        return self.segments[seg], t - self._start_t[seg]
+
+    def at(self, t, wrap=False):
+        segment, t_local = self._segment(t, wrap)
+        return segment.at(t_local)
+
+    def state_at(self, t, wrap=False):
+        segment, t_local = self._segment(t, wrap)
+        return segment.state_at(t_local)
+
+
+def generate_joint_space_min_jerk(start, goal, time_to_go: float, dt: float):
     """
     Primitive joint space minimum jerk trajectory planner.
     Assumes zero velocity & acceleration at start & goal.
@@ -34,27 +136,38 @@ def generate_joint_space_min_jerk(
         start: Start joint position of shape (N,)
         goal: Goal joint position of shape (N,)
         time_to_go: Trajectory duration in seconds
-        hz: Frequency of output trajectory
+        dt: Period of output trajectory
     Returns:
-        waypoints: List of waypoints
+        MinJerkTrajectory
     """
-    steps =  int(time_to_go/dt)
+    return generate_joint_space_min_jerk_batch(start[None], goal[None], [time_to_go], dt)[0]
 
-    p_traj, pd_traj, pdd_traj = _min_jerk_spaces(steps, time_to_go)
 
-    D = goal - start
-    q_traj = start[None, :] + D[None, :] * p_traj[:, None]
-    qd_traj = D[None, :] * pd_traj[:, None]
-    qdd_traj = D[None, :] * pdd_traj[:, None]
-
-    waypoints = [
-        {
-            "time_from_start": i * dt,
-            "position": q_traj[i, :],
-            "velocity": qd_traj[i, :],
-            "acceleration": qdd_traj[i, :],
-        }
-        for i in range(steps)
-    ]
+def generate_joint_space_min_jerk_batch(starts, goals, times_to_go, dt: float):
+    """
+    Minimum jerk trajectories for a batch of start/goal pairs, evaluating the
+    normalized profile once per distinct duration.
+    Args:
+        starts: Start positions of shape (B, N)
+        goals: Goal positions of shape (B, N)
+        times_to_go: Durations in seconds, shape (B,)
+        dt: Period of output trajectories
+    Returns:
+        List of B MinJerkTrajectory
+    """
+    starts = np.asarray(starts, dtype=np.float64)
+    goals = np.asarray(goals, dtype=np.float64)
+    times_to_go = np.broadcast_to(np.asarray(times_to_go, dtype=np.float64), len(starts))
+    trajs = [None] * len(starts)
+    for time_to_go in np.unique(times_to_go):
+        batch = np.flatnonzero(times_to_go == time_to_go)
+        steps = int(time_to_go / dt)
+        p_traj, pd_traj, pdd_traj = _min_jerk_spaces(steps, time_to_go)
 
-    return waypoints
+        D = goals[batch] - starts[batch]
+        q_traj = starts[batch, None, :] + D[:, None, :] * p_traj[None, :, None]
+        qd_traj = D[:, None, :] * pd_traj[None, :, None]
+        qdd_traj = D[:, None, :] * pdd_traj[None, :, None]
+        for j, b in enumerate(batch):
+            trajs[b] = MinJerkTrajectory(q_traj[j], qd_traj[j], qdd_traj[j], dt)
+    return trajs
@@ -1,4 +1,7 @@
 import queue
+from collections import namedtuple
+import struct
+import threading
 import time
 import numpy as np
 import open3d as o3d
@@ -63,11 +66,210 @@ class Buffer:
         return self.queue.get()
 
 
+NPY_MAGIC_V1 = b"\x93NUMPY\x01\x00"
+NPY_MAGIC_V2 = b"\x93NUMPY\x02\x00"
+NPY_MAX_ROWS = 10**18  # placeholder used to size the header once
+
+
+def _npy_header(dtype, shape, header_len=None):
+    """npy header bytes, padded with spaces to header_len (or to 64 byte alignment)"""
+    header = repr(
+        {
+            "descr": np.lib.format.dtype_to_descr(dtype),
+            "fortran_order": False,
+            "shape": tuple(shape),
+        }
+    ).encode("latin1")
+    magic, len_fmt = NPY_MAGIC_V1, "<H"
+    if len(header) + 64 > 2**16:
+        magic, len_fmt = NPY_MAGIC_V2, "<I"
+    prefix_len = len(magic) + struct.calcsize(len_fmt)
+    if header_len is None:
+        header_len = -(-(prefix_len + len(header) + 1) // 64) * 64
+    pad = header_len - prefix_len - len(header) - 1
+    assert pad >= 0, "header does not fit in reserved space"
+    header = header + b" " * pad + b"\n"
+    return magic + struct.pack(len_fmt, len(header)) + header
+
+
+class NpyAppender:
+    """Appends rows to a .npy file through a growable memmap.
+
+    The header reserves room for any row count and is rewritten after each
+    append, after the data has been flushed, so the file on disk is always a
+    valid .npy holding every appended row. Space is preallocated past the end
+    and trimmed on close (or by recover_npy after a crash). Each append waits
+    on the disk, callers with a deadline hand their rows to an NpyWriterThread.
+    """
+
+    def __init__(self, path, dtype, row_shape=(), capacity=4096):
+        self.path = str(path)
+        self.dtype = np.dtype(dtype)
+        self.row_shape = tuple(row_shape)
+        self.row_bytes = self.dtype.itemsize * int(np.prod(self.row_shape))
+        self.header_len = len(
+            _npy_header(self.dtype, (NPY_MAX_ROWS,) + self.row_shape)
+        )
+        self.n = 0
+        self.capacity = 0
+        self._mm = None
+        self._file = open(self.path, "wb+")
+        # synced by the first append or close
+        self._write_header(sync=False)
+        self._grow(capacity)
+
+    def __len__(self):
+        return self.n
+
+    @property
+    def data(self):
+        """view of the rows appended so far"""
+        return self._mm[: self.n]
+
+    def _write_header(self, sync=True):
+        self._file.seek(0)
+        self._file.write(
+            _npy_header(self.dtype, (self.n,) + self.row_shape, self.header_len)
+        )
+        self._file.flush()
+        if sync:
+            os.fsync(self._file.fileno())
+
+    def _grow(self, capacity):
+        if self._mm is not None:
+            self._mm.flush()
+            del self._mm
+        self._file.truncate(self.header_len + capacity * self.row_bytes)
+        self.capacity = capacity
+        self._mm = np.memmap(
+            self._file,
+            dtype=self.dtype,
+            mode="r+",
+            offset=self.header_len,
+            shape=(capacity,) + self.row_shape,
+        )
+
+    def append(self, rows):
+        """appends (N, *row_shape) rows and makes them durable"""
+        rows = np.asarray(rows, dtype=self.dtype).reshape((-1,) + self.row_shape)
+        n_new = self.n + len(rows)
+        if n_new > self.capacity:
+            self._grow(max(n_new, 2 * self.capacity))
+        self._mm[self.n : n_new] = rows
+        self._mm.flush()
+        self.n = n_new
+        self._write_header()
+
+    def close(self):
+        if self._file.closed:
+            return
+        self._mm.flush()
+        del self._mm
+        self._mm = None
+        self._file.truncate(self.header_len + self.n * self.row_bytes)
+        self._write_header()
+        self._file.close()
+
+
+def recover_npy(path):
+    """trims a .npy left behind by a crashed NpyAppender, returns its row count"""
+    with open(str(path), "rb+") as f:
+        if np.lib.format.read_magic(f) == (1, 0):
+            shape, _, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, _, dtype = np.lib.format.read_array_header_2_0(f)
+        data_len = int(np.prod(shape)) * dtype.itemsize
+        f.truncate(f.tell() + data_len)
+    return shape[0]
+
+
+def load_npy(path):
+    """memory-maps a .npy, falling back to a plain load when it has no rows"""
+    try:
+        return np.load(str(path), mmap_mode="r")
+    except ValueError:
+        return np.load(str(path))
+
+
+class NpyWriterThread:
+    """
+    Hands chunks to NpyAppenders from a background thread, so their flush and
+    fsync never block the caller. put(chunk, i) appends to the i-th appender and
+    close() closes all of them once the queue is drained.
+    """
+
+    def __init__(self, *appenders):
+        self.appenders = appenders
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                break
+            i, chunk = item
+            self.appenders[i].append(chunk)
+            self.queue.task_done()
+        for appender in self.appenders:
+            appender.close()
+
+    def put(self, chunk, i=0):
+        self.queue.put((i, chunk))
+
+    def flush(self):
+        """waits until every chunk put so far has been appended"""
+        self.queue.join()
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+
+Frame = namedtuple("Frame", ["frame_id", "timestamp", "data"])
+
+
+class LatestSlot:
+    """Single-slot handoff of the most recent item from a producer thread.
+
+    Every put overwrites the slot, tagging the item with an increasing frame id and
+    a time.monotonic() timestamp, so a slow consumer skips stale items instead of
+    queueing them.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._frame = None
+        self._next_id = 0
+
+    def put(self, data, timestamp=None):
+        timestamp = time.monotonic() if timestamp is None else timestamp
+        with self._cond:
+            self._frame = Frame(self._next_id, timestamp, data)
+            self._next_id += 1
+            self._cond.notify_all()
+
+    def get(self, after_id=-1, timeout=None):
+        """latest frame newer than after_id, None if none arrives within timeout"""
+        with self._cond:
+            self._cond.wait_for(
+                lambda: self._frame is not None and self._frame.frame_id > after_id,
+                timeout=timeout,
+            )
+            if self._frame is None or self._frame.frame_id <= after_id:
+                return None
+            return self._frame
+
+
 class DatasetWriter:
-    def __init__(self, prefix="", print_hz=True):
+    def __init__(self, prefix="", print_hz=True, stream=False, chunk_size=512):
         self.hz = Hz(print_hz=print_hz)
         self.save_buffer = []
         self.i = 0
+        self.stream = stream
+        self.chunk_size = chunk_size
 
         # Create dataset folders
         if not prefix == "":
@@ -91,6 +293,18 @@ class DatasetWriter:
                 default_flow_style=False,
             )
 
+        self.writer = None
+        if self.stream:
+            # timeseries.npy is (T, 1), matching np.array of add_sample records
+            self.writer = NpyWriterThread(
+                NpyAppender(
+                    self.timeseries_file,
+                    rpal_const.PALP_DTYPE,
+                    row_shape=(1,),
+                    capacity=8 * chunk_size,
+                )
+            )
+
     def save_subsurface_pcd(self, pts):
         subsurface_pcd = o3d.geometry.PointCloud()
         subsurface_pcd.points = o3d.utility.Vector3dVector(pts)
@@ -105,8 +319,17 @@ class DatasetWriter:
     def save_roi_pcd(self, pcd):
         o3d.io.write_point_cloud(str(self.roi_pcd.absolute()), pcd)
 
+    def _flush_chunk(self):
+        if len(self.save_buffer) > 0:
+            self.writer.put(np.array(self.save_buffer))
+            self.save_buffer = []
+
     def save(self, autosave=False):
-        np.save(str(self.timeseries_file), np.array(self.save_buffer))
+        if self.stream:
+            self._flush_chunk()
+            self.writer.close()
+        else:
+            np.save(str(self.timeseries_file), np.array(self.save_buffer))
         if not autosave:
             save = input(f"Save or not to {str(self.dataset_folder)}? (enter 0 or 1)")
             save = bool(int(save))
@@ -118,6 +341,15 @@ class DatasetWriter:
     def add_sample(self, sample):
         assert sample.dtype == rpal_const.PALP_DTYPE
         self.save_buffer.append(sample)
+        if self.stream and len(self.save_buffer) >= self.chunk_size:
+            self._flush_chunk()
+
+    def add_samples(self, samples):
+        """adds a (N,) batch of records, stored the same as N add_sample calls"""
+        assert samples.dtype == rpal_const.PALP_DTYPE
+        self.save_buffer.extend(samples[:, np.newaxis])
+        if self.stream and len(self.save_buffer) >= self.chunk_size:
+            self._flush_chunk()
 
 
 class CalibrationWriter:
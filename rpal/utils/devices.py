@@ -1,12 +1,28 @@
+import os
+import struct
+import threading
+import time
+import tty
+
 import numpy as np
 import open3d as o3d
 import open3d.core as o3c
 import serial
 
+from rpal.utils.data_utils import LatestSlot
+
 
 class RealsenseCapture:
-    def __init__(self):
+    """
+    Realsense RGBD capture producing tensor point clouds.
+
+    With threaded=True a background thread grabs frames continuously into a LatestSlot,
+    so latest() returns the newest frame without waiting on the camera. decimation
+    keeps every n-th depth pixel along each image axis.
+    """
 
+    def __init__(self, threaded=False, decimation=1):
+        self.decimation = decimation
         self.rs_cfg = o3d.t.io.RealSenseSensorConfig(
             {
                 "serial": "",
@@ -24,7 +40,14 @@ class RealsenseCapture:
         self.rs.start_capture(True)  # true: start recording with capture
         self.intrinsics = o3c.Tensor(self.rs.get_metadata().intrinsics.intrinsic_matrix)
 
-    def read(self, get_mask=None):
+        self.slot = None
+        self._stop_event = threading.Event()
+        self._thread = None
+        if threaded:
+            self.start()
+
+    def capture(self, get_mask=None):
+        """blocks for the next frame, returns (color image, tensor point cloud)"""
         im_rgbd = self.rs.capture_frame(True, True)  # wait for frames and align them
 
         color_tensor = im_rgbd.color.as_tensor()
@@ -37,43 +60,255 @@ class RealsenseCapture:
             depth_np[mask == 0] = 0
 
         pcd = o3d.t.geometry.PointCloud.create_from_rgbd_image(
-            im_rgbd, self.intrinsics
-        ).to_legacy()
+            im_rgbd, self.intrinsics, stride=self.decimation
+        )
+        return color_np, pcd
+
+    def _grab(self):
+        while not self._stop_event.is_set():
+            self.slot.put(self.capture())
 
+    def start(self):
+        if self._thread is not None:
+            return
+        self.slot = LatestSlot()
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._grab, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        self._thread.join()
+        self._thread = None
+
+    def latest(self, after_id=-1, timeout=None):
+        """
+        Newest Frame(frame_id, timestamp, (color, tensor pcd)) with frame_id > after_id,
+        waiting up to timeout for one. Requires threaded capture.
+        """
+        assert self.slot is not None, "start() the capture thread first"
+        return self.slot.get(after_id=after_id, timeout=timeout)
+
+    def read(self, get_mask=None, legacy=True):
+        if self._thread is not None and get_mask is None:
+            color_np, pcd = self.latest().data
+        else:
+            color_np, pcd = self.capture(get_mask=get_mask)
+        if legacy:
+            pcd = pcd.to_legacy()
         return color_np, pcd
 
 
+FORCE_SYNC = b"\xaa\x55"
+# sync, device time (us), Fx, Fy, Fz (N), xor checksum of the bytes after sync
+FORCE_FRAME = struct.Struct("<2sI3fB")
+FORCE_SAMPLE_DTYPE = np.dtype(
+    [
+        ("t", np.float64),  # host time.monotonic() on receipt
+        ("device_t", np.float64),  # s
+        ("Fxyz", np.dtype((np.float64, 3))),
+    ]
+)
+
+
+def _xor_checksum(payload):
+    return np.bitwise_xor.reduce(np.frombuffer(payload, dtype=np.uint8), initial=0)
+
+
+def encode_force_frame(device_t, Fxyz):
+    payload = FORCE_FRAME.pack(FORCE_SYNC, int(device_t * 1e6) & 0xFFFFFFFF, *Fxyz, 0)
+    payload = payload[:-1]
+    return payload + bytes([_xor_checksum(payload[len(FORCE_SYNC) :])])
+
+
+class ForceFrameParser:
+    """Splits a byte stream into binary force frames, resyncing on bad checksums"""
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.bad_frames = 0
+
+    def feed(self, data):
+        """returns [(device_t, Fxyz)] for every complete frame in data"""
+        self.buffer += data
+        frames = []
+        while True:
+            start = self.buffer.find(FORCE_SYNC)
+            if start < 0:
+                del self.buffer[: max(len(self.buffer) - 1, 0)]
+                break
+            del self.buffer[:start]
+            if len(self.buffer) < FORCE_FRAME.size:
+                break
+            frame = bytes(self.buffer[: FORCE_FRAME.size])
+            _, device_t, fx, fy, fz, checksum = FORCE_FRAME.unpack(frame)
+            if checksum != _xor_checksum(frame[len(FORCE_SYNC) : -1]):
+                self.bad_frames += 1
+                del self.buffer[: len(FORCE_SYNC)]
+                continue
+            del self.buffer[: FORCE_FRAME.size]
+            frames.append((device_t * 1e-6, (fx, fy, fz)))
+        return frames
+
+
+class AsciiForceParser:
+    """Parses the "T:<time>,Fx,Fy,Fz" line protocol"""
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.bad_frames = 0
+
+    def feed(self, data):
+        self.buffer += data
+        frames = []
+        *lines, self.buffer = self.buffer.split(b"\n")
+        for line in lines:
+            elements = line.strip().split(b",")
+            if not elements[0].startswith(b"T:") or len(elements) < 4:
+                continue
+            try:
+                device_t = float(elements[0][2:]) * 1e-3
+                frames.append((device_t, tuple(float(e) for e in elements[1:4])))
+            except ValueError:
+                self.bad_frames += 1
+        return frames
+
+
 class ForceSensor:
-    def __init__(self, port="/dev/ttyACM0", baudrate="115200"):
-        self.serial = serial.Serial(port=port)
+    """
+    Force sensor driver. A reader thread parses frames off the serial port as they
+    arrive, stamps them with the host receive time and keeps the most recent
+    history_size samples, so reads never block the control loop.
+
+    protocol is "binary" for FORCE_FRAME frames or "ascii" for the line protocol.
+    """
+
+    def __init__(
+        self, port="/dev/ttyACM0", baudrate="115200", protocol="ascii", history_size=1024
+    ):
+        self.serial = serial.Serial(port=port, timeout=0.05)
         self.serial.baudrate = baudrate
+        self.parser = ForceFrameParser() if protocol == "binary" else AsciiForceParser()
 
+        self._samples = np.zeros(history_size, dtype=FORCE_SAMPLE_DTYPE)
+        self._count = 0
+        self._last_read = 0
+        self._lock = threading.Lock()
+        self._first_sample = threading.Event()
+        self._stop_event = threading.Event()
+
+        if protocol == "ascii":
+            self._handshake()
+        self._thread = threading.Thread(target=self._read_loop, daemon=True)
+        self._thread.start()
+
+    def _handshake(self):
         while True:
-            while self.serial.inWaiting() == 1:
-                pass
             bytes_data = self.serial.readline()
-            print(str(bytes_data, encoding="utf-8"))
             if bytes_data.startswith(bytes("T:", "utf-8")):
                 print("initialized")
+                self.parser.feed(bytes_data)
                 break
-            else:
+            elif len(bytes_data) > 0:
+                print(str(bytes_data, encoding="utf-8", errors="replace"))
                 self.serial.write(bytes("ACK", "utf-8"))
 
-    def read(self):
-        if self.serial.inWaiting() == 0:
-            return
-        else:
-            while self.serial.inWaiting() == 2:
+    def _read_loop(self):
+        while not self._stop_event.is_set():
+            data = self.serial.read(max(1, self.serial.in_waiting))
+            if len(data) == 0:
                 continue
-            self.data_stream = self.serial.readline()
-        self.data_string = str(self.data_stream)
-        self.elements = self.data_string.split(",")
-        Fxyz = np.array(
-            [
-                (float)(self.elements[1]),
-                (float)(self.elements[2]),
-                (float)(self.elements[3]),
-            ],
-            dtype=np.double,
-        )
-        return Fxyz
+            t = time.monotonic()
+            frames = self.parser.feed(data)
+            if len(frames) == 0:
+                continue
+            with self._lock:
+                for device_t, Fxyz in frames:
+                    sample = self._samples[self._count % len(self._samples)]
+                    sample["t"] = t
+                    sample["device_t"] = device_t
+                    sample["Fxyz"] = Fxyz
+                    self._count += 1
+            self._first_sample.set()
+
+    @property
+    def count(self):
+        return self._count
+
+    @property
+    def bad_frames(self):
+        return self.parser.bad_frames
+
+    def wait_for_sample(self, timeout=None):
+        return self._first_sample.wait(timeout)
+
+    def latest(self):
+        """most recent sample as a FORCE_SAMPLE_DTYPE record, None before the first"""
+        with self._lock:
+            if self._count == 0:
+                return None
+            return self._samples[(self._count - 1) % len(self._samples)].copy()
+
+    def since(self, t):
+        """samples received after host time t, oldest first, limited to the history"""
+        with self._lock:
+            n = min(self._count, len(self._samples))
+            idx = np.arange(self._count - n, self._count) % len(self._samples)
+            samples = self._samples[idx]
+        return samples[samples["t"] > t]
+
+    def read(self):
+        """latest Fxyz if a sample arrived since the last read, otherwise None"""
+        with self._lock:
+            if self._count == self._last_read:
+                return
+            self._last_read = self._count
+            return self._samples[(self._count - 1) % len(self._samples)]["Fxyz"].copy()
+
+    def close(self):
+        self._stop_event.set()
+        self._thread.join()
+        self.serial.close()
+
+
+class SimulatedForceSensor:
+    """
+    Streams force frames over a pseudo terminal so ForceSensor can be run without
+    hardware: ForceSensor(port=sim.port, protocol=sim.protocol). force_fn maps
+    time since start (s) to Fxyz.
+    """
+
+    def __init__(self, protocol="binary", rate=1000, force_fn=None):
+        self.protocol = protocol
+        self.rate = rate
+        self.force_fn = force_fn
+        if self.force_fn is None:
+            self.force_fn = lambda t: np.array([0.0, 0.0, np.sin(2 * np.pi * t)])
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._write_loop, daemon=True)
+        self._thread.start()
+
+    def encode(self, t, Fxyz):
+        if self.protocol == "binary":
+            return encode_force_frame(t, Fxyz)
+        return "T:{:d},{:.4f},{:.4f},{:.4f}\r\n".format(int(t * 1e3), *Fxyz).encode()
+
+    def _write_loop(self):
+        start = time.monotonic()
+        next_t = start
+        while not self._stop_event.is_set():
+            t = time.monotonic() - start
+            os.write(self._master, self.encode(t, self.force_fn(t)))
+            next_t += 1 / self.rate
+            time.sleep(max(0.0, next_t - time.monotonic()))
+
+    def close(self):
+        self._stop_event.set()
+        self._thread.join()
+        os.close(self._master)
+        os.close(self._slave)
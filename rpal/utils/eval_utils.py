@@ -1,4 +1,34 @@
+import numpy as np
 import open3d as o3d
+from scipy.spatial import cKDTree
+
+
+def nn_distances(points_from, points_to):
+    """distance from every point in points_from to its nearest neighbour in points_to"""
+    dists, _ = cKDTree(points_to).query(points_from, k=1, workers=-1)
+    return dists
+
+
+def f_score_curve(points_gt, points_reconstructed, taus):
+    """Precision, recall and F-score for every threshold in taus.
+
+    One batched nearest neighbour query is made per direction, after which
+    each threshold is a binary search into the sorted distances.
+    """
+    taus = np.atleast_1d(np.asarray(taus, dtype=np.float64))
+    dists_precision = np.sort(nn_distances(points_reconstructed, points_gt))
+    dists_recall = np.sort(nn_distances(points_gt, points_reconstructed))
+
+    # a point counts when its distance is strictly below tau
+    precision = np.searchsorted(dists_precision, taus, side="left") / len(
+        dists_precision
+    )
+    recall = np.searchsorted(dists_recall, taus, side="left") / len(dists_recall)
+    denom = precision + recall
+    f_score = np.divide(
+        2 * precision * recall, denom, out=np.zeros_like(denom), where=denom > 0
+    )
+    return precision, recall, f_score
 
 
 def compute_f_score(mesh_gt, mesh_reconstructed, tau=5.0):
@@ -6,19 +36,7 @@ def compute_f_score(mesh_gt, mesh_reconstructed, tau=5.0):
     pcd_gt = mesh_gt.sample_points_uniformly(number_of_points=10000)
     pcd_reconstructed = mesh_reconstructed.sample_points_uniformly(number_of_points=10000)
 
-    # Compute distances from reconstructed to ground-truth and vice versa
-    dist_reconstructed_to_gt = pcd_reconstructed.compute_point_cloud_distance(pcd_gt)
-    dist_gt_to_reconstructed = pcd_gt.compute_point_cloud_distance(pcd_reconstructed)
-
-    # Compute precision and recall
-    precision = sum([1
-                     for d in dist_reconstructed_to_gt if d < tau]) / len(dist_reconstructed_to_gt)
-    recall = sum([1 for d in dist_gt_to_reconstructed if d < tau]) / len(dist_gt_to_reconstructed)
-
-    # Compute F-score
-    if precision + recall > 0:
-        f_score = 2 * (precision * recall) / (precision + recall)
-    else:
-        f_score = 0
-
-    return f_score
+    _, _, f_score = f_score_curve(
+        np.asarray(pcd_gt.points), np.asarray(pcd_reconstructed.points), tau
+    )
+    return f_score[0]
@@ -3,6 +3,7 @@ from enum import Enum
 
 import numpy as np
 import pinocchio as pin
+from scipy.spatial.transform import Rotation
 
 
 class InterpType(Enum):
@@ -12,9 +13,18 @@ class InterpType(Enum):
 
 
 class Interpolator:
+    """
+    Interpolates from start to goal over a fixed number of steps. start is kept by
+    reference, so a pose the caller updates in place (the measured end-effector
+    pose) is interpolated from on every step. For SE3, next() returns the OSC action
+    row [x, y, z, axis-angle] and xyz_quat the matching target pose.
+    """
+
     def __init__(self, interp_type=InterpType.POS):
         self.i = 0
         self.traj_t = []
+        self._action = np.zeros(6)
+        self._xyz_quat = np.zeros(7)
         self._done = True
         self._start = None
         self._goal = None
@@ -30,7 +40,7 @@ class Interpolator:
             self.interp_fn = self.se3_lerp
 
     def __len__(self):
-        return len(self.traj)
+        return len(self.traj_t)
 
     def init(
         self,
@@ -48,12 +58,25 @@ class Interpolator:
         self._done = False
 
     def next(self):
+        """next step, for SE3 the [x, y, z, axis-angle] action row"""
         if self.i < len(self.traj_t) - 1:
             self.i += 1
         else:
             self._done = True
+        if self.interp_type == InterpType.SE3:
+            se3 = self.se3_lerp(self._start, self._goal, self.traj_t[self.i])
+            self._xyz_quat = pin.SE3ToXYZQUAT(se3)
+            self._action = np.concatenate(
+                [self._xyz_quat[:3], Rotation.from_quat(self._xyz_quat[3:]).as_rotvec()]
+            )
+            return self._action
         return self.interp_fn(self._start, self._goal, self.traj_t[self.i])
 
+    @property
+    def xyz_quat(self):
+        """[x, y, z, qx, qy, qz, qw] of the step last returned by next()"""
+        return self._xyz_quat
+
     @property
     def done(self):
         return self._done
@@ -73,7 +96,6 @@ class Interpolator:
         n = start * pin.exp6(t * pin.log6(start.inverse() * end))
         return n
 
-
 if __name__ == "__main__":
     start = pin.SE3.Identity()
     end = pin.SE3.Identity()
@@ -85,3 +107,8 @@ if __name__ == "__main__":
     interp.init(start, end, 1000)
     assert np.allclose(interp.interp_fn(start, end, interp.traj_t[0]), start)
     assert np.allclose(interp.interp_fn(start, end, interp.traj_t[-1]), end)
+    for i in range(1, 1000):
+        interp.next()
+        if i % 111 == 0:
+            se3 = interp.se3_lerp(start, end, interp.traj_t[i])
+            assert np.allclose(interp.xyz_quat, pin.SE3ToXYZQUAT(se3))
@@ -1,22 +1,176 @@
 import numpy as np
 import open3d as o3d
+import rpal.utils.constants as rpal_const
+from rpal.utils.cache_utils import cache_file, hash_arrays, hash_file, save_npz
 from rpal.utils.constants import array2constant
 from scipy.spatial.transform import Rotation
 import matplotlib
 
 
+POLYGON_AXES = {"x": 0, "y": 1, "z": 2}
+
+
+def aabb_mask(points, min_bound, max_bound):
+    return np.all((points >= min_bound) & (points <= max_bound), axis=1)
+
+
+def obb_mask(points, center, R, extent):
+    local = (points - center) @ R
+    return np.all(np.abs(local) <= np.asarray(extent) / 2, axis=1)
+
+
+def polygon_mask(points, polygon, orthogonal_axis="z", axis_min=-1.0, axis_max=1.0):
+    """even-odd point in polygon test in the plane orthogonal to orthogonal_axis"""
+    axis = POLYGON_AXES[orthogonal_axis.lower()]
+    plane = [i for i in range(3) if i != axis]
+    u, v = points[:, plane[0]], points[:, plane[1]]
+    poly_u, poly_v = polygon[:, plane[0]], polygon[:, plane[1]]
+
+    inside = np.zeros(len(points), dtype=bool)
+    for i in range(len(polygon)):
+        u1, v1 = poly_u[i - 1], poly_v[i - 1]
+        u2, v2 = poly_u[i], poly_v[i]
+        if v1 == v2:
+            continue
+        crosses = (v1 > v) != (v2 > v)
+        u_cross = u1 + (v - v1) * (u2 - u1) / (v2 - v1)
+        inside ^= crosses & (u < u_cross)
+    w = points[:, axis]
+    return inside & (w >= axis_min) & (w <= axis_max)
+
+
+def crop_mask(volume, pcd):
+    """
+    Boolean mask of the points of pcd inside volume, an AxisAlignedBoundingBox,
+    OrientedBoundingBox or SelectionPolygonVolume.
+    """
+    return volume_mask(volume, np.asarray(pcd.points))
+
+
+def volume_mask(volume, points):
+    """crop_mask for an (N,3) array of points"""
+    if isinstance(volume, o3d.geometry.AxisAlignedBoundingBox):
+        return aabb_mask(points, volume.min_bound, volume.max_bound)
+    if isinstance(volume, o3d.geometry.OrientedBoundingBox):
+        return obb_mask(points, volume.center, volume.R, volume.extent)
+    if isinstance(volume, o3d.visualization.SelectionPolygonVolume):
+        return polygon_mask(
+            points,
+            np.asarray(volume.bounding_polygon),
+            volume.orthogonal_axis,
+            volume.axis_min,
+            volume.axis_max,
+        )
+    raise TypeError(f"cannot crop with {type(volume).__name__}")
+
+
+def split_crop(volume, pcd):
+    """returns (points inside volume, points outside volume) as point clouds"""
+    mask = crop_mask(volume, pcd)
+    return (
+        pcd.select_by_index(np.flatnonzero(mask)),
+        pcd.select_by_index(np.flatnonzero(~mask)),
+    )
+
+
 def inverse_crop(bbox, pcd):
-    inside_points = pcd.crop(bbox)
-    # Get the indices of the points that were not returned by the crop function, i.e., the points outside the bounding box
-    # First, create a set of all indices
-    all_indices = set(range(len(pcd.points)))
-    # Then, get the indices of points inside the bounding box
-    inside_indices = set([i for i in range(len(inside_points.points))])
-    # Now, find the difference to get indices of points outside the bounding box
-    outside_indices = all_indices - inside_indices
-    # Select the points outside the bounding box to create a new point cloud
-    inverse_cropped_pcd = pcd.select_by_index(list(outside_indices), invert=True)
-    return inverse_cropped_pcd
+    """points of pcd outside bbox"""
+    return pcd.select_by_index(np.flatnonzero(~crop_mask(bbox, pcd)))
+
+
+class VoxelAccumulator:
+    """
+    Fuses point cloud frames into a sparse voxel map holding the weighted mean point and
+    color of every occupied voxel. Voxel coordinates are packed into sorted int64 keys, so a
+    frame is merged with one np.unique and one searchsorted regardless of how many frames
+    came before. Memory is bounded by max_voxels, past which the lightest voxels are dropped.
+    """
+
+    KEY_BITS = 21
+
+    def __init__(self, voxel_size=0.0005, max_voxels=2_000_000):
+        self.voxel_size = voxel_size
+        self.max_voxels = max_voxels
+        self._keys = np.zeros(0, dtype=np.int64)
+        self._weights = np.zeros(0)
+        self._pt_sums = np.zeros((0, 3))
+        self._color_sums = np.zeros((0, 3))
+        self._weight_total = 0.0
+        self._pt_total = np.zeros(3)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def _pack(self, points):
+        idx = np.floor(points / self.voxel_size).astype(np.int64)
+        idx += 1 << (self.KEY_BITS - 1)
+        return (idx[:, 0] << (2 * self.KEY_BITS)) | (idx[:, 1] << self.KEY_BITS) | idx[:, 2]
+
+    def integrate(self, points, colors=None, weights=None):
+        """merges a frame of (N,3) points, weights default to 1 per point"""
+        if len(points) == 0:
+            return
+        if colors is None:
+            colors = np.zeros_like(points)
+        if weights is None:
+            weights = np.ones(len(points))
+
+        keys, inv = np.unique(self._pack(points), return_inverse=True)
+        inv = inv.reshape(-1)
+        frame_w = np.bincount(inv, weights, len(keys))
+        frame_pts = np.stack(
+            [np.bincount(inv, weights * points[:, i], len(keys)) for i in range(3)], axis=1
+        )
+        frame_colors = np.stack(
+            [np.bincount(inv, weights * colors[:, i], len(keys)) for i in range(3)], axis=1
+        )
+
+        pos = np.searchsorted(self._keys, keys)
+        found = pos < len(self._keys)
+        found[found] = self._keys[pos[found]] == keys[found]
+        self._weights[pos[found]] += frame_w[found]
+        self._pt_sums[pos[found]] += frame_pts[found]
+        self._color_sums[pos[found]] += frame_colors[found]
+
+        new = ~found
+        self._keys = np.insert(self._keys, pos[new], keys[new])
+        self._weights = np.insert(self._weights, pos[new], frame_w[new])
+        self._pt_sums = np.insert(self._pt_sums, pos[new], frame_pts[new], axis=0)
+        self._color_sums = np.insert(self._color_sums, pos[new], frame_colors[new], axis=0)
+
+        self._weight_total += frame_w.sum()
+        self._pt_total += frame_pts.sum(axis=0)
+        if len(self._keys) > self.max_voxels:
+            self._drop_lightest()
+
+    def _drop_lightest(self):
+        keep = np.argpartition(-self._weights, self.max_voxels)[: self.max_voxels]
+        keep.sort()
+        self._keys = self._keys[keep]
+        self._weights = self._weights[keep]
+        self._pt_sums = self._pt_sums[keep]
+        self._color_sums = self._color_sums[keep]
+        self._weight_total = self._weights.sum()
+        self._pt_total = self._pt_sums.sum(axis=0)
+
+    @property
+    def centroid(self):
+        """weighted mean of every point integrated so far"""
+        return self._pt_total / max(self._weight_total, 1e-12)
+
+    @property
+    def points(self):
+        return self._pt_sums / self._weights[:, None]
+
+    @property
+    def colors(self):
+        return self._color_sums / self._weights[:, None]
+
+    def to_pcd(self):
+        pcd = o3d.geometry.PointCloud()
+        pcd.points = o3d.utility.Vector3dVector(self.points)
+        pcd.colors = o3d.utility.Vector3dVector(self.colors)
+        return pcd
 
 
 def color_entity(
@@ -450,3 +604,82 @@ def visualize_pcds(pcds, meshes=[], frames=[], tfs=[], surf_norms=[], tf_size=0.
     # Update the visualization window
     vis.run()
     vis.destroy_window()
+
+
+MESH_ARRAY_KEYS = ("vertices", "triangles", "vertex_colors", "vertex_normals")
+
+
+def mesh_to_arrays(mesh):
+    return (
+        np.asarray(mesh.vertices),
+        np.asarray(mesh.triangles),
+        np.asarray(mesh.vertex_colors),
+        np.asarray(mesh.vertex_normals),
+    )
+
+
+def mesh_from_arrays(vertices, triangles, vertex_colors, vertex_normals):
+    mesh = o3d.geometry.TriangleMesh(
+        o3d.utility.Vector3dVector(vertices), o3d.utility.Vector3iVector(triangles)
+    )
+    mesh.vertex_colors = o3d.utility.Vector3dVector(vertex_colors)
+    mesh.vertex_normals = o3d.utility.Vector3dVector(vertex_normals)
+    return mesh
+
+
+GT_CACHE_VERSION = 1
+
+
+def cached_ground_truth_tumors(
+    gt_path,
+    color_to_filter=[0.0, 0.0, 0.0],
+    threshold=0.1,
+    eps=0.002,
+    min_points=50,
+    cache_dir=rpal_const.GT_CACHE_PATH,
+):
+    """
+    Segments the tumours out of a ground truth scan (color_filter -> clustering, sorted by
+    size) and meshes each with scan2mesh, or loads both from cache_dir if the same scan file
+    and parameters were used before. Returns (tumour point clouds, tumour meshes).
+    """
+    key = hash_arrays(
+        np.asarray(color_to_filter, dtype=np.float64),
+        rpal_const.BBOX_PHANTOM,
+        rpal_const.GT_SCAN_POSE,
+        threshold=float(threshold),
+        eps=float(eps),
+        min_points=int(min_points),
+        scan=hash_file(gt_path),
+        version=GT_CACHE_VERSION,
+    )
+    path = cache_file(cache_dir, "gt_tumors", key)
+    if path.exists():
+        print(f"loading cached ground truth {path.name}")
+        data = np.load(str(path))
+        pcds, meshes = [], []
+        for i in range(int(data["n_tumors"])):
+            pcd = o3d.geometry.PointCloud()
+            pcd.points = o3d.utility.Vector3dVector(data[f"pcd_points_{i}"])
+            pcd.colors = o3d.utility.Vector3dVector(data[f"pcd_colors_{i}"])
+            pcds.append(pcd)
+            meshes.append(
+                mesh_from_arrays(*(data[f"mesh_{k}_{i}"] for k in MESH_ARRAY_KEYS))
+            )
+        return pcds, meshes
+
+    gt_scan = o3d.io.read_point_cloud(str(gt_path))
+    gt_scan = color_filter(gt_scan, color_to_filter=color_to_filter, threshold=threshold)
+    gt_tumors = clustering(gt_scan, eps=eps, min_points=min_points)
+    gt_tumors = sorted(gt_tumors, key=lambda pc: len(pc.points))
+    pcds = [color_entity(gt_tumor, color_map="rainbow") for gt_tumor in gt_tumors]
+    meshes = [color_entity(scan2mesh(pcd)) for pcd in pcds]
+
+    arrays = {"n_tumors": len(pcds)}
+    for i, (pcd, mesh) in enumerate(zip(pcds, meshes)):
+        arrays[f"pcd_points_{i}"] = np.asarray(pcd.points)
+        arrays[f"pcd_colors_{i}"] = np.asarray(pcd.colors)
+        for k, arr in zip(MESH_ARRAY_KEYS, mesh_to_arrays(mesh)):
+            arrays[f"mesh_{k}_{i}"] = arr
+    save_npz(path, **arrays)
+    return pcds, meshes
@@ -1,6 +1,27 @@
+import time
+from multiprocessing import shared_memory
+
 import numpy as np
 
 
+def wait_until(predicate, timeout=None, stop_event=None, poll=0.001, name="condition"):
+    """
+    Sleeps in poll second steps (doubling up to 10x poll) until predicate() holds,
+    for state that cannot signal an event itself such as another library's buffers.
+    Returns False if stop_event is set first, raises TimeoutError after timeout.
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    sleep = poll
+    while not predicate():
+        if stop_event is not None and stop_event.is_set():
+            return False
+        if deadline is not None and time.monotonic() > deadline:
+            raise TimeoutError(f"timed out after {timeout}s waiting for {name}")
+        time.sleep(sleep)
+        sleep = min(2 * sleep, 10 * poll)
+    return True
+
+
 class RunningStats:
     """from https://github.com/eanswer/TactileSimulation/blob/main/utils/running_mean_std.py"""
 
@@ -75,3 +96,165 @@ class RingBuffer:
 
     def __str__(self):
         return str(self.get())
+
+
+class SharedRingBuffer:
+    """
+    Single-producer/single-consumer ring buffer of structured records over
+    multiprocessing.shared_memory. The producer only writes slots the consumer
+    has released and publishes them by bumping the write sequence number, so
+    every record is read exactly once and never while being written. When the
+    ring is full new records are dropped and counted.
+    """
+
+    # header: write seq, read seq, dropped count
+    _HEADER = np.dtype([("write_seq", np.uint64), ("read_seq", np.uint64), ("dropped", np.uint64)])
+
+    def __init__(self, dtype, capacity=1024, name=None):
+        self.dtype = np.dtype(dtype)
+        self.capacity = capacity
+        size = self._HEADER.itemsize + capacity * self.dtype.itemsize
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+            self._owner = True
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            self._owner = False
+        self._header = np.ndarray(1, dtype=self._HEADER, buffer=self.shm.buf)
+        self._records = np.ndarray(
+            capacity, dtype=self.dtype, buffer=self.shm.buf, offset=self._HEADER.itemsize
+        )
+        if self._owner:
+            self._header[0] = (0, 0, 0)
+
+    @classmethod
+    def attach(cls, name, dtype, capacity):
+        return cls(dtype, capacity=capacity, name=name)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    @property
+    def write_seq(self):
+        return int(self._header["write_seq"][0])
+
+    @property
+    def read_seq(self):
+        return int(self._header["read_seq"][0])
+
+    @property
+    def dropped(self):
+        return int(self._header["dropped"][0])
+
+    def __len__(self):
+        return self.write_seq - self.read_seq
+
+    def wait(self, min_records=1, timeout=None, stop_event=None):
+        """waits until at least min_records are ready to drain"""
+        return wait_until(
+            lambda: len(self) >= min_records,
+            timeout=timeout,
+            stop_event=stop_event,
+            name=f"{min_records} records",
+        )
+
+    def push(self, record) -> bool:
+        """producer side, returns False if the record was dropped"""
+        write_seq = self.write_seq
+        if write_seq - self.read_seq >= self.capacity:
+            self._header["dropped"] += 1
+            return False
+        self._records[write_seq % self.capacity] = record
+        self._header["write_seq"] = write_seq + 1
+        return True
+
+    def drain(self, max_records=None) -> np.ndarray:
+        """consumer side, copies out every published record not yet read"""
+        read_seq = self.read_seq
+        n = self.write_seq - read_seq
+        if max_records is not None:
+            n = min(n, max_records)
+        start = read_seq % self.capacity
+        first = min(n, self.capacity - start)
+        out = np.empty(n, dtype=self.dtype)
+        out[:first] = self._records[start : start + first]
+        out[first:] = self._records[: n - first]
+        self._header["read_seq"] = read_seq + n
+        return out
+
+    def close(self):
+        del self._header, self._records
+        self.shm.close()
+        if self._owner:
+            self.shm.unlink()
+
+
+class SharedArray:
+    """
+    Fixed-shape array in shared memory guarded by a sequence number (a seqlock), for
+    state one process publishes and others poll, e.g. the latest end-effector pose.
+    The sequence is odd while a write is in progress and counts completed writes x2,
+    so readers can wait for a newer value and never return a torn one.
+    """
+
+    def __init__(self, shape, dtype=np.float64, name=None):
+        self.shape = shape
+        self.dtype = np.dtype(dtype)
+        size = 8 + int(np.prod(shape)) * self.dtype.itemsize
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+            self._owner = True
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            self._owner = False
+        self._seq = np.ndarray(1, dtype=np.uint64, buffer=self.shm.buf)
+        self._data = np.ndarray(shape, dtype=self.dtype, buffer=self.shm.buf, offset=8)
+        if self._owner:
+            self._seq[0] = 0
+            self._data[:] = 0
+
+    @classmethod
+    def attach(cls, name, shape, dtype=np.float64):
+        return cls(shape, dtype=dtype, name=name)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    @property
+    def seq(self):
+        """number of completed writes"""
+        return int(self._seq[0]) // 2
+
+    def write(self, values):
+        self._seq[0] += 1
+        self._data[:] = values
+        self._seq[0] += 1
+
+    def read(self):
+        """consistent copy of the latest value"""
+        while True:
+            seq = int(self._seq[0])
+            if seq % 2 == 1:
+                continue
+            values = self._data.copy()
+            if int(self._seq[0]) == seq:
+                return values
+
+    def wait(self, after_seq=0, timeout=None, stop_event=None):
+        """waits for a write newer than after_seq, returns the new seq or None if stopped"""
+        if not wait_until(
+            lambda: self.seq > after_seq,
+            timeout=timeout,
+            stop_event=stop_event,
+            name=f"write after seq {after_seq}",
+        ):
+            return None
+        return self.seq
+
+    def close(self):
+        del self._seq, self._data
+        self.shm.close()
+        if self._owner:
+            self.shm.unlink()
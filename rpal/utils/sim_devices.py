@@ -0,0 +1,216 @@
+import time
+
+import numpy as np
+import open3d as o3d
+from scipy.spatial import cKDTree
+from scipy.spatial.transform import Rotation
+
+import rpal.utils.constants as rpal_const
+from rpal.utils.constants import PALP_CONST
+
+
+class SimClock:
+    """
+    Simulated time, advanced by SimFrankaInterface.control() one control period at a
+    time. speedup=1.0 paces the simulation to wall time, speedup=None runs as fast
+    as the loop allows. Exposes time() so it can stand in for the time module.
+    """
+
+    def __init__(self, speedup=None):
+        self.speedup = speedup
+        self._t = 0.0
+        self._wall_start = time.monotonic()
+
+    def time(self):
+        return self._t
+
+    def advance(self, dt):
+        self._t += dt
+        if self.speedup is not None:
+            remaining = self._wall_start + self._t / self.speedup - time.monotonic()
+            if remaining > 0:
+                time.sleep(remaining)
+
+
+def _tumor_footprint(mesh_path, scale=1e-3):
+    """
+    triangles (M, 3, 2) of a tumour mesh projected along its thinnest axis, centered
+    on the footprint bounding box. STL tumours are modelled in mm.
+    """
+    mesh = o3d.io.read_triangle_mesh(str(mesh_path))
+    verts = np.asarray(mesh.vertices) * scale
+    tris = np.asarray(mesh.triangles)
+    extent = verts.max(axis=0) - verts.min(axis=0)
+    plane_axes = np.delete(np.arange(3), np.argmin(extent))
+    verts_2d = verts[:, plane_axes]
+    verts_2d -= (verts_2d.max(axis=0) + verts_2d.min(axis=0)) / 2
+    return verts_2d[tris]
+
+
+def _in_triangles(pts, tris):
+    """mask (N,) of 2D points covered by any of the triangles (M, 3, 2)"""
+    a, b, c = tris[:, 0], tris[:, 1], tris[:, 2]
+    v0, v1 = b - a, c - a
+    det = v0[:, 0] * v1[:, 1] - v0[:, 1] * v1[:, 0]
+    valid = np.abs(det) > 1e-12
+    a, v0, v1, det = a[valid], v0[valid], v1[valid], det[valid]
+
+    d = pts[:, None, :] - a[None]
+    u = (d[..., 0] * v1[:, 1] - d[..., 1] * v1[:, 0]) / det
+    v = (v0[:, 0] * d[..., 1] - v0[:, 1] * d[..., 0]) / det
+    return np.any((u >= 0) & (v >= 0) & (u + v <= 1), axis=1)
+
+
+class PhantomModel:
+    """
+    Phantom surface as the grid cell centers and normals with a stiffness (N/m) per
+    cell. Contact is evaluated against the nearest cell: penetration is the depth
+    below the cell along its normal and the reaction force is stiffness * depth
+    along the normal.
+    """
+
+    def __init__(self, centers, normals, stiffness):
+        self.centers = np.ascontiguousarray(centers, dtype=np.float64)
+        self.normals = np.ascontiguousarray(normals, dtype=np.float64)
+        self.stiffness = np.ascontiguousarray(stiffness, dtype=np.float64)
+        self._tree = cKDTree(self.centers)
+
+    @classmethod
+    def from_grid(
+        cls,
+        surface_grid_map,
+        tumor_mesh_path=None,
+        tissue_stiffness=800.0,
+        tumor_stiffness=2500.0,
+        tumor_offset=np.zeros(2),
+    ):
+        """
+        Builds the phantom from a SurfaceGridMap. Cells whose in-plane position falls
+        inside the footprint of tumor_mesh_path, centered on the grid and shifted by
+        tumor_offset (m), get tumor_stiffness.
+        """
+        centers, normals = surface_grid_map.idx_to_pt_many(
+            surface_grid_map.cell_idx2grid_idx
+        )
+        stiffness = np.full(len(centers), tissue_stiffness)
+        if tumor_mesh_path is not None:
+            # in-plane axes of the surface from the principal directions of the cells
+            origin = centers.mean(axis=0)
+            _, _, Vt = np.linalg.svd(centers - origin, full_matrices=False)
+            cells_2d = (centers - origin) @ Vt[:2].T - tumor_offset
+            tumor = _in_triangles(cells_2d, _tumor_footprint(tumor_mesh_path))
+            stiffness[tumor] = tumor_stiffness
+        return cls(centers, normals, stiffness)
+
+    def contact(self, pos):
+        """(penetration depth, surface normal, stiffness) at the cell nearest to pos"""
+        _, i = self._tree.query(pos, k=1)
+        depth = np.dot(self.centers[i] - pos, self.normals[i])
+        return max(depth, 0.0), self.normals[i], self.stiffness[i]
+
+    def force(self, pos):
+        depth, normal, k = self.contact(pos)
+        return k * depth * normal
+
+
+class SimFrankaInterface:
+    """
+    Stand-in for deoxys' FrankaInterface covering the subset used by the palpation
+    scripts. Each control() call steps the end effector by one control period on
+    clock: OSC_POSE targets are tracked through a first-order lag and held against
+    the phantom by the controller stiffness, hybrid force control offsets x/y from
+    the contact point by action[:2] while regulating the normal force to
+    PALP_CONST.max_Fz.
+    """
+
+    def __init__(
+        self,
+        phantom: PhantomModel,
+        clock: SimClock,
+        control_freq=PALP_CONST.ctrl_freq,
+        init_pose=rpal_const.GT_SCAN_POSE,
+        time_constant=0.05,
+    ):
+        self.phantom = phantom
+        self.clock = clock
+        self.dt = 1 / control_freq
+        self._alpha = 1 - np.exp(-self.dt / time_constant)
+        self._pos = np.array(init_pose[:3], dtype=np.float64)
+        self._rot = Rotation.from_quat(init_pose[3:7]).as_matrix()
+        self._free_pos = self._pos.copy()
+        self._force_anchor = None
+        self._states = []
+
+    @property
+    def _state_buffer(self):
+        return self._states
+
+    @_state_buffer.setter
+    def _state_buffer(self, states):
+        # the real interface refills the buffer from its state subscriber right away
+        self._states = states
+        self._publish_state()
+
+    def _publish_state(self):
+        self._states[:] = [(self._rot.copy(), self._pos.copy())]
+
+    @property
+    def last_eef_rot_and_pos(self):
+        return self._rot.copy(), self._pos[:, None].copy()
+
+    @property
+    def last_eef_quat_and_pos(self):
+        return Rotation.from_matrix(self._rot).as_quat(), self._pos[:, None].copy()
+
+    def _osc_step(self, action, controller_cfg):
+        self._force_anchor = None
+        self._free_pos += self._alpha * (action[:3] - self._free_pos)
+        self._rot = Rotation.from_rotvec(action[3:6]).as_matrix()
+
+        # quasi-static balance of the controller spring against the phantom
+        depth, normal, k = self.phantom.contact(self._free_pos)
+        kp = controller_cfg.Kp.translation if controller_cfg is not None else 300.0
+        self._pos = self._free_pos + normal * depth * k / (kp + k)
+
+    def _force_step(self, action):
+        if self._force_anchor is None:
+            self._force_anchor = self._pos.copy()
+        depth, normal, k = self.phantom.contact(self._pos)
+        target_depth = PALP_CONST.max_Fz / k
+        pos = self._force_anchor.copy()
+        pos[:2] += action[:2]
+        pos -= normal * (np.dot(pos - self._pos, normal))
+        pos -= normal * self._alpha * (target_depth - depth)
+        self._pos = pos
+        self._free_pos = pos.copy()
+
+    def control(self, controller_type, action, controller_cfg=None):
+        if controller_type == rpal_const.FORCE_CTRL_TYPE:
+            self._force_step(action)
+        else:
+            self._osc_step(action, controller_cfg)
+        self.clock.advance(self.dt)
+        self._publish_state()
+
+    def close(self):
+        pass
+
+
+class PhantomForceSensor:
+    """
+    ForceSensor stand-in reading the phantom contact force at the current end
+    effector position, with gaussian noise of noise_std (N).
+    """
+
+    def __init__(self, robot: SimFrankaInterface, noise_std=0.02, seed=None):
+        self.robot = robot
+        self.noise_std = noise_std
+        self._rng = np.random.default_rng(seed)
+
+    def read(self):
+        _, pos = self.robot.last_eef_rot_and_pos
+        Fxyz = self.robot.phantom.force(pos.flatten())
+        return Fxyz + self._rng.normal(0, self.noise_std, 3)
+
+    def close(self):
+        pass
@@ -1,26 +1,55 @@
 # From https://github.com/commaai/openpilot/blob/7638572e38773cdc5ecbf804ffc733fa9dd7893f/common/realtime.py#L48
+import bisect
 import gc
 import os
 import time
 from collections import deque
-from typing import List, Optional, Union
+from multiprocessing import shared_memory
+from pathlib import Path
+from typing import List, Optional, Sequence, Union
 
+import numpy as np
+import yaml
 from setproctitle import getproctitle
 
+# histogram bucket edges (s), 10 per decade from 1 us to 1 s plus under/overflow
+LATENCY_EDGES = np.geomspace(1e-6, 1.0, 61)
+
 
 class Ratekeeper:
+    """
+    Keeps a loop at rate Hz. Every monitor_time() records the loop period, its
+    deviation from the nominal interval (jitter) and, for missed deadlines, the
+    lateness into LatencyHistograms, available through snapshot() and save().
+    The schedule starts at the first tick, so setup time before the loop is not
+    counted, and restarts from the current time when the loop falls more than
+    one interval behind instead of bursting to catch up.
+
+    With spin_threshold (s) keep_time() sleeps until spin_threshold before the
+    deadline and busy-waits the rest, trading one core for sub-millisecond
+    accuracy where time.sleep oversleeps.
+    """
+
     def __init__(
-        self, rate: float, print_delay_threshold: Optional[float] = 0.0, name=""
+        self,
+        rate: float,
+        print_delay_threshold: Optional[float] = 0.0,
+        name="",
+        spin_threshold: Optional[float] = None,
     ) -> None:
         """Rate in Hz for ratekeeping. print_delay_threshold must be nonnegative."""
         self._interval = 1.0 / rate
         self._next_frame_time = time.monotonic() + self._interval
+        self._deadline = self._next_frame_time
         self._print_delay_threshold = print_delay_threshold
+        self._spin_threshold = spin_threshold
         self._frame = 0
         self._remaining = 0.0
         self._process_name = name + " " + getproctitle()
         self._dts = deque([self._interval], maxlen=100)
         self._last_monitor_time = time.monotonic()
+        self._overruns = 0
+        self._stats = LatencyHistogram(["period", "jitter", "lateness"], shared=False)
 
     @property
     def frame(self) -> int:
@@ -30,6 +59,10 @@ class Ratekeeper:
     def remaining(self) -> float:
         return self._remaining
 
+    @property
+    def overruns(self) -> int:
+        return self._overruns
+
     @property
     def lagging(self) -> bool:
         avg_dt = sum(self._dts) / len(self._dts)
@@ -40,18 +73,38 @@ class Ratekeeper:
     def keep_time(self) -> bool:
         lagged = self.monitor_time()
         if self._remaining > 0:
-            time.sleep(self._remaining)
+            if self._spin_threshold is None:
+                time.sleep(self._remaining)
+            else:
+                coarse = self._deadline - time.monotonic() - self._spin_threshold
+                if coarse > 0:
+                    time.sleep(coarse)
+                while time.monotonic() < self._deadline:
+                    pass
         return lagged
 
     # this only monitor the cumulative lag, but does not enforce a rate
     def monitor_time(self) -> bool:
+        now = time.monotonic()
         prev = self._last_monitor_time
-        self._last_monitor_time = time.monotonic()
-        self._dts.append(self._last_monitor_time - prev)
+        self._last_monitor_time = now
+        dt = now - prev
+        self._dts.append(dt)
+        if self._frame > 0:
+            self._stats.record("period", dt)
+            self._stats.record("jitter", abs(dt - self._interval))
 
         lagged = False
-        remaining = self._next_frame_time - time.monotonic()
+        if self._frame == 0:
+            self._next_frame_time = max(self._next_frame_time, now)
+        self._deadline = self._next_frame_time
+        remaining = self._next_frame_time - now
         self._next_frame_time += self._interval
+        if remaining < 0:
+            self._overruns += 1
+            self._stats.record("lateness", -remaining)
+            if remaining < -self._interval:
+                self._next_frame_time = now + self._interval
         if (
             self._print_delay_threshold is not None
             and remaining < -self._print_delay_threshold
@@ -61,3 +114,175 @@ class Ratekeeper:
         self._frame += 1
         self._remaining = remaining
         return lagged
+
+    def snapshot(self) -> dict:
+        """loop timing so far: overruns, worst lateness and period/jitter summaries"""
+        stats = self._stats.summary()
+        return dict(
+            name=self._process_name.strip(),
+            rate_hz=1.0 / self._interval,
+            frames=self._frame,
+            overruns=self._overruns,
+            overrun_ratio=self._overruns / max(self._frame, 1),
+            worst_lateness_ms=stats["lateness"]["max_ms"],
+            spin_threshold_ms=(
+                None if self._spin_threshold is None else self._spin_threshold * 1e3
+            ),
+            period=stats["period"],
+            jitter=stats["jitter"],
+            lateness=stats["lateness"],
+        )
+
+    def save(self, path: Path):
+        """writes the histograms to path.npz and snapshot() to path.yml"""
+        path = Path(path)
+        np.savez(str(path.with_suffix(".npz")), **self._stats.snapshot())
+        with open(str(path.with_suffix(".yml")), "w") as f:
+            yaml.dump(self.snapshot(), f, sort_keys=False)
+
+
+def time_fn(fn, *args, repeat: int = 1, warmup: int = 0, **kwargs) -> List[float]:
+    """Calls fn warmup + repeat times and returns the duration of the timed calls in seconds"""
+    for _ in range(warmup):
+        fn(*args, **kwargs)
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(*args, **kwargs)
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+class LatencyHistogram:
+    """
+    Fixed-bucket histograms of durations (s) for a set of named channels, with count,
+    total and max per channel. With shared=True the counters live in shared memory
+    created under a new name, or attached to when name is given, so one process can
+    record while another snapshots or saves them. There is a single writer per
+    channel and no lock; a reader may see a record half applied, which only shifts
+    the statistics by one sample.
+    """
+
+    def __init__(
+        self,
+        channels: Sequence[str],
+        edges=LATENCY_EDGES,
+        shared=True,
+        name=None,
+    ):
+        self.channels = list(channels)
+        self.edges = np.asarray(edges, dtype=np.float64)
+        self._edge_list = self.edges.tolist()
+        self._index = {c: i for i, c in enumerate(self.channels)}
+        n, n_buckets = len(self.channels), len(self.edges) + 1
+
+        self.shm = None
+        self._owner = name is None
+        size = n * (3 + n_buckets) * 8
+        if shared:
+            if name is None:
+                self.shm = shared_memory.SharedMemory(create=True, size=size)
+            else:
+                self.shm = shared_memory.SharedMemory(name=name)
+            buf = self.shm.buf
+        else:
+            buf = bytearray(size)
+        self._count = np.ndarray(n, dtype=np.uint64, buffer=buf)
+        self._total = np.ndarray(n, dtype=np.float64, buffer=buf, offset=8 * n)
+        self._max = np.ndarray(n, dtype=np.float64, buffer=buf, offset=16 * n)
+        self._hist = np.ndarray(
+            (n, n_buckets), dtype=np.uint64, buffer=buf, offset=24 * n
+        )
+        if self._owner:
+            self.reset()
+
+    @classmethod
+    def attach(cls, name, channels, edges=LATENCY_EDGES):
+        return cls(channels, edges=edges, name=name)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def reset(self):
+        self._count[:] = 0
+        self._total[:] = 0
+        self._max[:] = 0
+        self._hist[:] = 0
+
+    def record(self, channel: str, duration: float):
+        i = self._index[channel]
+        self._count[i] += 1
+        self._total[i] += duration
+        if duration > self._max[i]:
+            self._max[i] = duration
+        self._hist[i, bisect.bisect_right(self._edge_list, duration)] += 1
+
+    def snapshot(self) -> dict:
+        """copies of the counters, hist[i, b] counts durations in [edges[b-1], edges[b])"""
+        return dict(
+            channels=np.array(self.channels),
+            edges=self.edges.copy(),
+            count=self._count.copy(),
+            total=self._total.copy(),
+            max=self._max.copy(),
+            hist=self._hist.copy(),
+        )
+
+    def percentile(self, channel: str, q: float) -> float:
+        """upper edge of the bucket holding the q-th percentile, an upper bound"""
+        i = self._index[channel]
+        hist = self._hist[i].copy()
+        if hist.sum() == 0:
+            return float("nan")
+        b = int(np.searchsorted(np.cumsum(hist), q / 100 * hist.sum()))
+        if b >= len(self.edges):
+            return float(self._max[i])
+        return float(min(self.edges[b], self._max[i]))
+
+    def summary(self, percentiles=(50, 90, 99)) -> dict:
+        """per channel count, mean, percentiles and max in ms"""
+        out = {}
+        for i, c in enumerate(self.channels):
+            count = int(self._count[i])
+            stats = dict(count=count)
+            stats["mean_ms"] = float(self._total[i] / max(count, 1) * 1e3)
+            for q in percentiles:
+                stats[f"p{q}_ms"] = self.percentile(c, q) * 1e3
+            stats["max_ms"] = float(self._max[i] * 1e3)
+            out[c] = stats
+        return out
+
+    def save(self, path: Path):
+        """writes the counters to path.npz and the summary to path.yml"""
+        path = Path(path)
+        np.savez(str(path.with_suffix(".npz")), **self.snapshot())
+        with open(str(path.with_suffix(".yml")), "w") as f:
+            yaml.dump(self.summary(), f, sort_keys=False)
+
+    def close(self):
+        del self._count, self._total, self._max, self._hist
+        if self.shm is not None:
+            self.shm.close()
+            if self._owner:
+                self.shm.unlink()
+
+
+class StageProfiler(LatencyHistogram):
+    """
+    Times consecutive stages of a loop: tick() at the top of every iteration, then
+    mark(stage) at the end of each stage records the time since the previous tick
+    or mark.
+    """
+
+    def __init__(self, stages: Sequence[str], edges=LATENCY_EDGES, shared=True, name=None):
+        super().__init__(stages, edges=edges, shared=shared, name=name)
+        self._last = time.perf_counter()
+
+    def tick(self):
+        self._last = time.perf_counter()
+
+    def mark(self, stage: str):
+        now = time.perf_counter()
+        self.record(stage, now - self._last)
+        self._last = now